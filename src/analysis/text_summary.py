@@ -42,8 +42,9 @@ import argparse                   # Version 1.1
 
 from src.data.preprocessing_text import clean_text
 from src.data.preprocessing_text import replace_typical_misspell
+from src.data.preprocessing_text import StopwordFilter
 
-from gensim.models import KeyedVectors                  # Version 3.7,1
+from src.features.embedding_store import load_embedding
 import networkx as nx                                   # Version 2.2
 from sklearn.metrics.pairwise import cosine_similarity  # Version 0.20.1
 
@@ -218,7 +219,8 @@ def preprocess_corpus(text, stop_words=""):
     """
 
     if stop_words == "":
-        stop_words = ["a", "an", "to", "of", "and", "it"]
+        stop_words = "summary"
+    stopword_filter = StopwordFilter(stop_words)
 
     preprocessed = []
     for sentence in text:
@@ -227,11 +229,7 @@ def preprocess_corpus(text, stop_words=""):
         # fix spelling
         x = replace_typical_misspell(x)
         # remove stop words
-        sentence_no_stopwords = []
-        for word in x.split():
-            if word not in stop_words:
-                sentence_no_stopwords.append(word)
-        processed_sentences = " ".join(sentence_no_stopwords)
+        processed_sentences = " ".join(stopword_filter(x.split()))
         preprocessed.append(processed_sentences)
 
     return preprocessed
@@ -244,15 +242,17 @@ def load_word_embeddings(file_path):
     Parameters
     ----------
     file_path: str
-        The file path to the downloaded embeddings
+        The file path to the downloaded embeddings, or the directory it was
+        converted to with src/features/embedding_store.py
     Returns
     -------
     loaded_embedding: gensim.models.keyedvectors.Word2VecKeyedVectors
-        Returns the embeddings loaded as a gensim object
+        Returns the embeddings loaded as a gensim object, or as a memory
+        mapped EmbeddingStore for a converted directory
 
     """
 
-    loaded_embedding = KeyedVectors.load_word2vec_format(file_path)
+    loaded_embedding = load_embedding(file_path)
     return loaded_embedding
 
 
@@ -0,0 +1,112 @@
+# benchmark_ner.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script times the detection of sensitive comments with the original
+# one comment at a time spaCy loop and with the batched SensitiveTextDetector
+# for several numbers of processes, with and without the name prefilter, and
+# checks they all find the same comments
+
+# USAGE:
+'''
+python src/data/benchmark_ner.py \
+--input_xlsx data/raw/2018_wes_qual_sample.xlsx \
+--n_comments 20000 \
+--n_process 1 4 16
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import argparse
+import itertools
+import spacy
+from src.data.sensitive_text import SensitiveTextDetector, iter_excel_chunks
+from src.data.sensitive_text import name_check
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark named entity '
+                                     'recognition of sensitive comments')
+
+    parser.add_argument('--input_xlsx', '-i', type=str, dest='input_xlsx',
+                        action='store',
+                        default='data/raw/2018_wes_qual_sample.xlsx',
+                        help='the xlsx file with the comments')
+
+    parser.add_argument('--skiprows', '-s', type=int, dest='skiprows',
+                        action='store', default=0,
+                        help='Number of rows to skip when reading xlsx')
+
+    parser.add_argument('--n_comments', '-c', type=int, dest='n_comments',
+                        action='store', default=20000,
+                        help='the number of comments, the comments in the '
+                        'xlsx are repeated to reach this number')
+
+    parser.add_argument('--n_process', '-n', type=int, dest='n_process',
+                        action='store', nargs='+', default=[1, 4, 16],
+                        help='the numbers of processes to time')
+
+    parser.add_argument('--batch_size', '-b', type=int, dest='batch_size',
+                        action='store', default=1000,
+                        help='the number of comments in each spaCy batch')
+
+    args = parser.parse_args()
+    return args
+
+
+def loop_sensitive_text(comments):
+    '''The original detection, the full pipeline is run on each comment'''
+
+    nlp = spacy.load("en_core_web_sm")
+    docs = [nlp(str(comment)) for comment in comments]
+
+    sensitive_person_index = []
+    for index, doc in enumerate(docs):
+        for ent in doc.ents:
+            if ent.label_ == "PERSON":
+                if any(name in name_check for name in ent.text.split()):
+                    sensitive_person_index.append(index)
+
+    return sensitive_person_index
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    comments = []
+    for df in iter_excel_chunks(args.input_xlsx, args.skiprows):
+        comments.extend(df[df.iloc[:, 1].notnull()].iloc[:, 1])
+    comments = list(itertools.islice(itertools.cycle(comments),
+                                     args.n_comments))
+    print('Benchmarking', len(comments), 'comments')
+
+    start = time.time()
+    expected = loop_sensitive_text(comments)
+    time_loop = time.time() - start
+    print('{:<34} {:9.1f} comments/s'.format('loop, full pipeline',
+                                             len(comments) / time_loop))
+
+    # Load the names before timing the prefilter
+    name_check.occurs_in('')
+
+    for n_process, prefilter in itertools.product(args.n_process,
+                                                  [False, True]):
+        detector = SensitiveTextDetector(batch_size=args.batch_size,
+                                         n_process=n_process,
+                                         prefilter=prefilter)
+        start = time.time()
+        result = detector(comments)
+        time_pipe = time.time() - start
+
+        label = 'pipe, %d processes%s' % (n_process,
+                                          ', prefilter' if prefilter else '')
+        assert result == expected, 'Sensitive comments differ for ' + label
+
+        print('{:<34} {:9.1f} comments/s  speedup {:5.2f}x  '
+              'skipped NER {:d} of {:d}'
+              .format(label, len(comments) / time_pipe, time_loop / time_pipe,
+                      detector.n_skipped, detector.n_comments))
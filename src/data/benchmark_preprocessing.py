@@ -0,0 +1,151 @@
+# benchmark_preprocessing.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script times the text preprocessing on a synthetic corpus of comments
+# and checks the results match the original chain of functions. It also times
+# the sharded multi-process preprocessing against the serial run, that they
+# give the same results is tested in tests/test_preprocessing.py
+
+# USAGE:
+'''
+python src/data/benchmark_preprocessing.py \
+--n_comments 1000000 \
+--n_workers 32
+'''
+
+# USAGE for Sample Data:
+'''
+python src/data/benchmark_preprocessing.py \
+--input_xlsx data/raw/2018_wes_qual_sample.xlsx
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from src.data.preprocessing_text import clean_text, clean_numbers
+from src.data.preprocessing_text import replace_typical_misspell
+from src.data.preprocessing_text import get_normalizer, mispell_dict
+from src.data.preprocessing_text import preprocess_batch, preprocess_profiles
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing on'
+                                     'a synthetic corpus')
+
+    parser.add_argument('--n_comments', '-n', type=int, dest='n_comments',
+                        action='store', default=1000000,
+                        help='the number of synthetic comments')
+
+    parser.add_argument('--seed', '-s', type=int, dest='seed',
+                        action='store', default=2019,
+                        help='the random seed for the synthetic corpus')
+
+    parser.add_argument('--n_workers', '-w', type=int, dest='n_workers',
+                        action='store', default=4,
+                        help='the number of processes for the sharded run')
+
+    parser.add_argument('--input_xlsx', '-i', type=str, dest='input_xlsx',
+                        action='store', default=None,
+                        help='use the comments from this xlsx file instead '
+                        'of a synthetic corpus')
+
+    args = parser.parse_args()
+    return args
+
+
+def get_synthetic_comments(n_comments, seed=2019):
+    '''Builds comments from common survey words, misspellings, numbers and
+    punctuation so every preprocessing rule is exercised'''
+
+    rng = np.random.RandomState(seed)
+    common = ['the', 'My', 'supervisor', 'Work', 'team', 'and', 'of', 'to',
+              'a', 'pay', 'BC', 'Ministry', 'more', 'staff', 'is', 'we',
+              'need', 'better', 'training', 'for', 'all', 'employees', 'in',
+              'our', 'branch', 'management', 'should', 'be', 'not', 'with',
+              'work-life', "don't", 'staff/managers', 'fair,', 'time.',
+              'R&D', 'e.g.', '(IT)', 'more...', 'it’s', '“quoted”']
+    rare = ['2019', '15', '123456', '7', 'wwii1', 'Colour']
+    rare += list(mispell_dict.keys())
+
+    # Misspellings and numbers make up about 2% of the words
+    words = np.array(common + rare, dtype=object)
+    probs = np.array([0.98 / len(common)] * len(common)
+                     + [0.02 / len(rare)] * len(rare))
+
+    lengths = rng.randint(1, 60, size=n_comments)
+    tokens = rng.choice(words, size=lengths.sum(), p=probs / probs.sum())
+    splits = np.cumsum(lengths)[:-1]
+
+    return [' '.join(comment) for comment in np.split(tokens, splits)]
+
+
+def chain_preprocess(comments, profile):
+    '''The original sequence of functions applied to each comment'''
+
+    comments = [replace_typical_misspell(clean_text(x)) for x in comments]
+
+    if profile in ['glove_wiki', 'w2v_google_news']:
+        comments = [clean_numbers(x) for x in comments]
+
+    if profile in ['glove_wiki', 'bow']:
+        comments = [x.lower() for x in comments]
+
+    return comments
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    if args.input_xlsx is None:
+        comments = get_synthetic_comments(args.n_comments, args.seed)
+    else:
+        df = pd.read_excel(args.input_xlsx)
+        comments = df[df.iloc[:, 1].notnull()].iloc[:, 1].tolist()
+    print('Benchmarking', len(comments), 'comments')
+
+    for profile in ['glove_wiki', 'w2v_google_news', 'default', 'bow']:
+        start = time.time()
+        expected = chain_preprocess(comments, profile)
+        time_chain = time.time() - start
+
+        normalizer = get_normalizer(profile)
+        start = time.time()
+        result = [normalizer(x) for x in comments]
+        time_normalizer = time.time() - start
+
+        start = time.time()
+        result_batch = preprocess_batch(comments, profile, split=False)
+        time_batch = time.time() - start
+
+        assert result == expected, 'Output differs for ' + profile
+        assert result_batch == expected, 'Batch output differs for ' + profile
+
+        print('{:<16} chain {:7.2f}s  normalizer {:7.2f}s  batch {:7.2f}s  '
+              'speedup {:5.2f}x'
+              .format(profile, time_chain, time_normalizer, time_batch,
+                      time_chain / time_batch))
+
+    # A small chunksize makes sure the sample spreadsheet is split across
+    # processes
+    profiles = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
+    chunksize = max(1, min(10000, len(comments) // (args.n_workers * 4)))
+
+    start = time.time()
+    serial = preprocess_profiles(comments, profiles, chunksize=chunksize,
+                                 n_workers=1)
+    time_serial = time.time() - start
+
+    start = time.time()
+    sharded = preprocess_profiles(comments, profiles, chunksize=chunksize,
+                                  n_workers=args.n_workers)
+    time_sharded = time.time() - start
+
+    print('{} profiles serial {:7.2f}s  {} workers {:7.2f}s  speedup {:5.2f}x'
+          .format(len(profiles), time_serial, args.n_workers, time_sharded,
+                  time_serial / time_sharded))
@@ -0,0 +1,176 @@
+# benchmark_vocab.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script times counting the words of the comments and checking their
+# coverage in an embedding with the original loops and with build_vocab,
+# count_vocab and check_coverage, and checks they give the same results. The
+# coverage is checked for a synthetic vocabulary and embedding of the size of
+# the 2M word fasttext crawl embedding.
+
+# USAGE:
+'''
+python src/data/benchmark_vocab.py \
+--n_comments 1000000 \
+--n_vocab 2000000 \
+--n_workers 4
+'''
+
+# USAGE for Sample Data:
+'''
+python src/data/benchmark_vocab.py \
+--input_xlsx data/raw/2018_wes_qual_sample.xlsx
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import argparse
+import operator
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from collections import Counter
+from src.data.benchmark_preprocessing import get_synthetic_comments
+from src.data.preprocessing_text import preprocess_batch, build_vocab
+from src.data.preprocessing_text import count_vocab, check_coverage
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark counting and '
+                                     'checking the coverage of words')
+
+    parser.add_argument('--n_comments', '-n', type=int, dest='n_comments',
+                        action='store', default=1000000,
+                        help='the number of synthetic comments')
+
+    parser.add_argument('--n_vocab', '-v', type=int, dest='n_vocab',
+                        action='store', default=2000000,
+                        help='the number of words in the synthetic vocabulary '
+                        'and embedding for the coverage check')
+
+    parser.add_argument('--seed', '-s', type=int, dest='seed',
+                        action='store', default=2019,
+                        help='the random seed for the synthetic data')
+
+    parser.add_argument('--n_workers', '-w', type=int, dest='n_workers',
+                        action='store', default=4,
+                        help='the number of processes for count_vocab')
+
+    parser.add_argument('--input_xlsx', '-i', type=str, dest='input_xlsx',
+                        action='store', default=None,
+                        help='use the comments from this xlsx file instead '
+                        'of a synthetic corpus')
+
+    args = parser.parse_args()
+    return args
+
+
+def loop_build_vocab(sentences, verbose=True):
+    '''The original count, a dictionary updated one word at a time'''
+    vocab = {}
+    for sent in tqdm(sentences, disable=(not verbose)):
+        for word in sent:
+            try:
+                vocab[word] += 1
+            except KeyError:
+                vocab[word] = 1
+    return vocab
+
+
+def loop_check_coverage(vocab, embeddings_index):
+    '''The original coverage check, the vector of each word is looked up'''
+    a = {}
+    oov = {}
+    k = 0
+    i = 0
+    for word in tqdm(vocab):
+        try:
+            a[word] = embeddings_index[word]
+            k += vocab[word]
+        except KeyError:
+            oov[word] = vocab[word]
+            i += vocab[word]
+
+    vocab_coverage = len(a) / len(vocab)
+    text_coverage = k / (k + i)
+    sorted_x = sorted(oov.items(), key=operator.itemgetter(1))[::-1]
+
+    return vocab_coverage, text_coverage, sorted_x
+
+
+def get_synthetic_vocab(n_vocab, seed=2019):
+    '''Returns a vocabulary with Zipf distributed counts and an embedding of
+    the same size that has about 90% of its words'''
+
+    rng = np.random.RandomState(seed)
+    counts = rng.zipf(1.5, size=n_vocab).clip(max=10 ** 6)
+    vocab = dict(zip(('word%d' % i for i in range(n_vocab)), counts.tolist()))
+
+    # The embedding values are not read by check_coverage, an int stands in
+    # for each vector
+    known = np.flatnonzero(rng.rand(n_vocab) < 0.9)
+    embedding = {'word%d' % i: i for i in known}
+    embedding.update(('other%d' % i, i)
+                     for i in range(n_vocab - len(known)))
+
+    return vocab, embedding
+
+
+def report(label, time_loop, time_new):
+    print('{:<30} loop {:7.2f}s  new {:7.2f}s  speedup {:6.2f}x'
+          .format(label, time_loop, time_new, time_loop / time_new))
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    if args.input_xlsx is None:
+        comments = get_synthetic_comments(args.n_comments, args.seed)
+    else:
+        df = pd.read_excel(args.input_xlsx)
+        comments = df[df.iloc[:, 1].notnull()].iloc[:, 1].tolist()
+    print('Benchmarking', len(comments), 'comments')
+
+    profile = 'glove_wiki'
+    sentences = preprocess_batch(comments, profile)
+
+    start = time.time()
+    expected = loop_build_vocab(sentences, verbose=False)
+    time_loop = time.time() - start
+
+    start = time.time()
+    vocab = build_vocab(sentences, verbose=False)
+    time_new = time.time() - start
+
+    assert vocab == Counter(expected), 'build_vocab counts differ'
+    report('build_vocab', time_loop, time_new)
+
+    # Serial preprocessing and the original count against the count of shards
+    # in a pool of processes
+    start = time.time()
+    expected = loop_build_vocab(preprocess_batch(comments, profile),
+                                verbose=False)
+    time_loop = time.time() - start
+
+    start = time.time()
+    vocab = count_vocab(comments, profile, n_workers=args.n_workers)
+    time_new = time.time() - start
+
+    assert vocab == Counter(expected), 'count_vocab counts differ'
+    report('count_vocab, %d workers' % args.n_workers, time_loop, time_new)
+
+    vocab, embedding = get_synthetic_vocab(args.n_vocab, args.seed)
+
+    start = time.time()
+    expected = loop_check_coverage(vocab, embedding)
+    time_loop = time.time() - start
+
+    start = time.time()
+    result = check_coverage(vocab, embedding)
+    time_new = time.time() - start
+
+    assert result == expected, 'check_coverage results differ'
+    report('check_coverage, %d words' % args.n_vocab, time_loop, time_new)
@@ -0,0 +1,69 @@
+# export_split_csv.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script writes csv copies of the test and train rows of the split for
+# the notebooks that read them, such as evaluate_results.ipynb. The pipeline
+# itself reads its rows from the single data file with the split index, so
+# the copies are only made on request. The split index is read and not made
+# again, so the stages that depend on it are not run again.
+
+# USAGE:
+'''
+python src/data/export_split_csv.py \
+--input_csv data/interim/desensitized_qualitative-data2018.csv \
+--split_index data/interim/split_index_2018.npz \
+--output_csv1 data/interim/test_2018-qualitative-data.csv \
+--output_csv2 data/interim/train_2018-qualitative-data.csv
+'''
+
+import sys
+sys.path.insert(1, '.')
+import argparse
+from src.data.qual_dataset import split_mask
+from src.data.split_qual_data import write_subset_csv
+
+# Default File paths:
+filepath_in = "data/interim/desensitized_qualitative-data2018.csv"
+filepath_index = "data/interim/split_index_2018.npz"
+filepath_out1 = "data/interim/test_2018-qualitative-data.csv"
+filepath_out2 = "data/interim/train_2018-qualitative-data.csv"
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Write csv copies of the '
+                                     'test and train rows')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store', default=filepath_in,
+                        help='the desensitized csv file')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=filepath_index,
+                        help='the split index file of the csv rows')
+
+    parser.add_argument('--output_csv1', '-o', type=str, dest='output_csv1',
+                        action='store', default=filepath_out1,
+                        help='the test output csv file')
+
+    parser.add_argument('--output_csv2', '-o2', type=str, dest='output_csv2',
+                        action='store', default=filepath_out2,
+                        help='the train output csv file')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=100000,
+                        help='the number of csv rows to read at a time')
+
+    args = parser.parse_args()
+    return args
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    write_subset_csv(args.input_csv, args.output_csv1,
+                     split_mask(args.split_index, 'test'), args.chunksize)
+    write_subset_csv(args.input_csv, args.output_csv2,
+                     split_mask(args.split_index, 'train'), args.chunksize)
@@ -0,0 +1,140 @@
+# preprocessing_cache.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script defines an on-disk cache of preprocessed comments that is shared
+# by the feature scripts so each comment is only preprocessed once for each
+# profile. Entries are keyed by a hash of the comment text and the fingerprint
+# of the preprocessing rules, and stored in a SQLite database. The database
+# is in write ahead log mode and waits for the lock, so steps that run at the
+# same time can share it.
+
+# Import modules
+import sqlite3
+import hashlib
+
+# Default file path
+filepath_cache = "data/interim/preprocessing_cache.sqlite3"
+
+
+class PreprocessingCache:
+    '''Content addressed cache of preprocessed comments.
+
+    Each profile records the fingerprint of the rules used to preprocess its
+    comments. When the fingerprint changes, for example because mispell_dict
+    or the cleaning functions changed, the old entries for the profile are
+    deleted. The least recently used entries are removed once the cache holds
+    more than max_entries comments.
+
+    Parameters
+    ----------
+    filepath : str, path to the SQLite database, created if missing
+    max_entries : int, maximum number of cached comments
+    timeout : float, seconds to wait for another process that is writing
+    '''
+    def __init__(self, filepath=filepath_cache, max_entries=1000000,
+                 timeout=600):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self._checked = {}
+
+        # Transactions take the write lock when they start, so a transaction
+        # that reads and then writes waits for other processes instead of
+        # failing when it tries to write
+        self._conn = sqlite3.connect(filepath, timeout=timeout,
+                                     isolation_level='IMMEDIATE')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS profiles '
+                           '(profile TEXT PRIMARY KEY, fingerprint TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                           '(key BLOB PRIMARY KEY, profile TEXT, value TEXT, '
+                           'accessed INTEGER)')
+        self._conn.execute('CREATE TEMP TABLE lookup (key BLOB PRIMARY KEY)')
+        self._conn.commit()
+
+        clock = self._conn.execute('SELECT MAX(accessed) FROM entries')
+        self._clock = (clock.fetchone()[0] or 0) + 1
+
+    @staticmethod
+    def _key(fingerprint, comment):
+        x = fingerprint + '\x00' + comment
+        return hashlib.blake2b(x.encode('utf-8', 'surrogatepass'),
+                               digest_size=16).digest()
+
+    def _check_profile(self, profile, fingerprint):
+        '''Deletes the entries for a profile if its rules have changed'''
+        if self._checked.get(profile) == fingerprint:
+            return
+
+        row = self._conn.execute('SELECT fingerprint FROM profiles '
+                                 'WHERE profile = ?', (profile,)).fetchone()
+        if row is None or row[0] != fingerprint:
+            self.invalidate(profile)
+            self._conn.execute('INSERT OR REPLACE INTO profiles '
+                               'VALUES (?, ?)', (profile, fingerprint))
+            self._conn.commit()
+
+        self._checked[profile] = fingerprint
+
+    def invalidate(self, profile=None):
+        '''Deletes the cached comments for one profile, or all profiles'''
+        if profile is None:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM profiles')
+            self._checked = {}
+        else:
+            self._conn.execute('DELETE FROM entries WHERE profile = ?',
+                               (profile,))
+            self._conn.execute('DELETE FROM profiles WHERE profile = ?',
+                               (profile,))
+            self._checked.pop(profile, None)
+        self._conn.commit()
+
+    def get_many(self, profile, fingerprint, comments):
+        '''Returns the cached preprocessed text for each comment, or None for
+        comments that are not in the cache'''
+        self._check_profile(profile, fingerprint)
+
+        # The keys are loaded into a temporary table so the lookup and the
+        # access time update are each a single query
+        keys = [self._key(fingerprint, comment) for comment in comments]
+        self._conn.executemany('INSERT OR IGNORE INTO lookup VALUES (?)',
+                               ((key,) for key in keys))
+        found = dict(self._conn.execute('SELECT key, value FROM entries '
+                                        'WHERE key IN (SELECT key FROM '
+                                        'lookup)'))
+        self._conn.execute('UPDATE entries SET accessed = ? WHERE key IN '
+                           '(SELECT key FROM lookup)', (self._clock,))
+        self._conn.execute('DELETE FROM lookup')
+        self._conn.commit()
+        self._clock += 1
+
+        return [found.get(key) for key in keys]
+
+    def put_many(self, profile, fingerprint, comments, processed):
+        '''Adds preprocessed comments to the cache and removes the least
+        recently used entries if the cache is full'''
+        self._check_profile(profile, fingerprint)
+
+        rows = ((self._key(fingerprint, comment), profile, value, self._clock)
+                for comment, value in zip(comments, processed))
+        self._conn.executemany('INSERT OR REPLACE INTO entries '
+                               'VALUES (?, ?, ?, ?)', rows)
+        self._clock += 1
+
+        n_entries = self._conn.execute('SELECT COUNT(*) FROM entries')
+        n_extra = n_entries.fetchone()[0] - self.max_entries
+        if n_extra > 0:
+            self._conn.execute('DELETE FROM entries WHERE key IN '
+                               '(SELECT key FROM entries '
+                               'ORDER BY accessed LIMIT ?)', (n_extra,))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
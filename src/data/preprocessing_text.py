@@ -7,9 +7,17 @@
 # https://www.kaggle.com/christofhenkel/how-to-preprocessing-when-using-embeddings
 
 # Import modules
+import os
 import re
+import hashlib
+import inspect
+import functools
+import itertools
 import operator
 import numpy as np
+import pandas as pd
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 tqdm.pandas()
 
@@ -59,11 +67,6 @@ def clean_numbers(x):
     return x
 
 
-def _get_mispell(mispell_dict):
-    mispell_re = re.compile('(%s)' % '|'.join(mispell_dict.keys()))
-    return mispell_dict, mispell_re
-
-
 mispell_dict = {'colour': 'color',
                 'centre': 'center',
                 'didnt': 'did not',
@@ -92,7 +95,161 @@ mispell_dict = {'colour': 'color',
                 'whatsapp': 'social medium',
                 'snapchat': 'social medium'
                 }
-mispellings, mispellings_re = _get_mispell(mispell_dict)
+
+
+class MisspellingReplacer:
+    '''Replaces misspellings using a trie of the misspelled words. The trie is
+    compiled to a regex where each character is only compared against the
+    branches of one trie node, so matching time depends on the length of the
+    text and not on the number of misspellings. The longest misspelling
+    starting at each position is replaced, so 'favour' can not shadow
+    'favourite' no matter the order of the dictionary.
+
+    Compiling the regex takes time proportional to the number of
+    misspellings, about 0.3 s for 10000 words. Words added with add or update
+    go into a second, pending trie with a small regex of its own, and the
+    text is matched against both. The regex of all the words is only
+    compiled again once the pending words are more than a quarter of the
+    words in it, so adding words one at a time between calls does not
+    compile the whole dictionary each time. Adding many words with one
+    update call is still cheaper than calling add for each.
+
+    Parameters
+    ----------
+    misspellings : dict mapping misspelled words to their correct spelling
+    whole_words : bool, only replace misspellings that are a whole word
+    '''
+    def __init__(self, misspellings=None, whole_words=False):
+        self.whole_words = whole_words
+        self.misspellings = {}
+        self.version = 0
+        self._trie = {}
+        self._pending = {}
+        self._n_pending = 0
+        self._n_compiled = 0
+        self._regex = None
+        self._pending_regex = None
+        self._fingerprint = None
+        self.update(misspellings or {})
+
+    def add(self, word, replacement):
+        '''Adds or changes one misspelling'''
+        self.update({word: replacement})
+
+    @staticmethod
+    def _insert(trie, word):
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def update(self, misspellings):
+        '''Adds or changes each misspelling in a dictionary. Changing the
+        replacement of a word already in the trie compiles nothing.'''
+        if not all(misspellings):
+            raise ValueError('misspelled word must not be empty')
+
+        for word, replacement in misspellings.items():
+            if word not in self.misspellings:
+                self._insert(self._trie, word)
+                self._insert(self._pending, word)
+                self._n_pending += 1
+                self._pending_regex = None
+            self.misspellings[word] = replacement
+
+        self.version += 1
+        self._fingerprint = None
+
+    @staticmethod
+    def _node_pattern(node):
+        # Children are tried before the end of a word so the longest
+        # misspelling matches first
+        branches = [re.escape(char) + MisspellingReplacer._node_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+
+        pattern = '(?:%s)' % '|'.join(branches)
+        if '' in node:
+            pattern += '?'
+        return pattern
+
+    def _trie_pattern(self, trie):
+        pattern = '(?=[%s])%s' % (re.escape(''.join(sorted(trie))),
+                                  self._node_pattern(trie))
+        if self.whole_words:
+            pattern = r'\b(?:%s)\b' % pattern
+        return pattern
+
+    @property
+    def pattern(self):
+        '''Regex pattern matching any of the misspellings'''
+        return self._trie_pattern(self._trie)
+
+    @property
+    def fingerprint(self):
+        '''Hash of the misspellings and settings used by the cache'''
+        if self._fingerprint is None:
+            rules = repr((list(self.misspellings.items()), self.whole_words))
+            self._fingerprint = hashlib.sha1(rules.encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def _compile(self):
+        if self._regex is None or self._n_pending * 4 > self._n_compiled:
+            # Merge the pending words into the regex of all the words
+            self._regex = re.compile(self.pattern)
+            self._n_compiled = len(self.misspellings)
+            self._pending = {}
+            self._n_pending = 0
+            self._pending_regex = None
+        elif self._pending_regex is None:
+            self._pending_regex = re.compile(
+                self._trie_pattern(self._pending))
+
+    def _replace(self, match):
+        return self.misspellings[match.group(0)]
+
+    def _sub_both(self, text):
+        # The leftmost match of either regex is replaced, the longer one if
+        # both start at the same position, which is the match of one regex
+        # of all the words. A regex is searched again from the end of the
+        # replaced word when its own match started before it
+        regexes = [self._regex, self._pending_regex]
+        matches = [regex.search(text) for regex in regexes]
+        pieces = []
+        pos = 0
+        while matches[0] is not None or matches[1] is not None:
+            match = min((match for match in matches if match is not None),
+                        key=lambda match: (match.start(), -match.end()))
+            pieces.append(text[pos:match.start()])
+            pieces.append(self.misspellings[match.group(0)])
+            pos = match.end()
+            matches = [regex.search(text, pos)
+                       if match is not None and match.start() < pos
+                       else match for regex, match in zip(regexes, matches)]
+        pieces.append(text[pos:])
+
+        return ''.join(pieces)
+
+    def __call__(self, text):
+        if not self.misspellings:
+            return text
+
+        if self._regex is None or self._n_pending and \
+                self._pending_regex is None:
+            self._compile()
+
+        if self._n_pending:
+            return self._sub_both(text)
+        return self._regex.sub(self._replace, text)
+
+
+# Shared by every profile and the text summary so misspellings added at
+# runtime are used everywhere
+misspelling_replacer = MisspellingReplacer(mispell_dict)
 
 
 def replace_typical_misspell(text):
@@ -107,10 +264,200 @@ def replace_typical_misspell(text):
     -------
     x : a string with corrected spelling
     '''
-    def replace(match):
-        return mispellings[match.group(0)]
+    return misspelling_replacer(text)
+
+
+###############################################################################
+# Single pass normalizer combining the functions above for each profile       #
+###############################################################################
+# Translate table giving the same result as clean_text for ASCII strings.
+# str.translate only has a fast path for ASCII strings when every character
+# maps to one ASCII character or is deleted, so '&' is replaced separately
+_punct_map = {punct: None for punct in '?!.,"#$%()*+:;<=>@[\\]^_`{|}~'}
+_punct_map.update({punct: ' ' for punct in "/-'"})
+_punct_table = str.maketrans(_punct_map)
+
+
+@functools.lru_cache(maxsize=None)
+def _rules_source():
+    # Source code of the cleaning functions, part of the rules fingerprint
+    functions = [clean_text, clean_numbers, _mask_digits,
+                 MisspellingReplacer, TextNormalizer]
+    return ''.join(inspect.getsource(function) for function in functions)
+
+
+_digit_runs = re.compile('[0-9]{2,}')
+
+
+def _mask_digits(match):
+    # Same result as clean_numbers: runs of 5+ digits become '#####' and runs
+    # of 2 to 4 digits become one '#' per digit
+    return '#' * min(len(match.group(0)), 5)
+
+
+class TextNormalizer:
+    '''Applies clean_text, replace_typical_misspell, clean_numbers and lower
+    to a string with a translate table, the misspelling regex and one regex
+    for all the digit runs. The output is identical to calling the functions
+    one after the other. Strings with
+    non-ASCII characters fall back to clean_text for the punctuation.
+
+    Parameters
+    ----------
+    mask_numbers : bool, replace digits with # the same as clean_numbers
+    lowercase : bool, lowercase the string after all other steps
+    replacer : MisspellingReplacer, shared with the other normalizers
+    '''
+    def __init__(self, mask_numbers=False, lowercase=False,
+                 replacer=misspelling_replacer):
+        self.mask_numbers = mask_numbers
+        self.lowercase = lowercase
+        self.replacer = replacer
+
+    @property
+    def fingerprint(self):
+        '''Hash of the misspellings and cleaning rules. It changes whenever
+        they change so cached results from older rules are not reused'''
+        rules = repr((self.replacer.fingerprint, self.mask_numbers,
+                      self.lowercase, sorted(_punct_map.items()),
+                      _rules_source()))
+        return hashlib.sha1(rules.encode('utf-8')).hexdigest()
+
+    def __call__(self, x):
+        x = str(x)
+        if not x.isascii():
+            x = x.replace('“', '').replace('”', '').replace('’', '')
+
+        if x.isascii():
+            x = x.translate(_punct_table).replace('&', ' & ')
+        else:
+            x = clean_text(x)
+
+        x = self.replacer(x)
+        if self.mask_numbers:
+            x = _digit_runs.sub(_mask_digits, x)
+
+        if self.lowercase:
+            x = x.lower()
+
+        return x
+
+
+# Normalizer settings (mask_numbers, lowercase) for each embedding profile
+normalizer_profiles = {'glove_wiki': (True, True),
+                       'glove_twitter': (True, True),
+                       'w2v_base_model': (True, True),
+                       'w2v_google_news': (True, False),
+                       'bow': (False, True),
+                       'default': (False, False)}
+_normalizers = {}
+
+
+def get_normalizer(profile):
+    '''Returns the TextNormalizer for an embedding profile, building it the
+    first time it is requested. Unknown embedding names use the default
+    profile the same as preprocess_for_embed.
+
+    Parameters
+    ----------
+    profile : str, name of the embedding or 'bow'
+
+    Returns
+    -------
+    normalizer : TextNormalizer
+    '''
+    if profile not in normalizer_profiles:
+        profile = 'default'
+
+    if profile not in _normalizers:
+        mask_numbers, lowercase = normalizer_profiles[profile]
+        _normalizers[profile] = TextNormalizer(mask_numbers, lowercase)
 
-    return mispellings_re.sub(replace, text)
+    return _normalizers[profile]
+
+
+def _cache_profile(profile):
+    '''Returns the profile name and fingerprint used to key the cache'''
+    if profile not in normalizer_profiles:
+        profile = 'default'
+    return profile, get_normalizer(profile).fingerprint
+
+
+def group_profiles(profiles):
+    '''Groups the profiles that are preprocessed the same way, such as the
+    embeddings that all use the default profile, so each group needs to be
+    preprocessed and tokenized only once
+
+    Parameters
+    ----------
+    profiles : list of str, the names of the embeddings or 'bow'
+
+    Returns
+    -------
+    groups : dict with the first profile of each group and the list of the
+        profiles in the group
+    '''
+    groups = {}
+    for profile in profiles:
+        groups.setdefault(_cache_profile(profile), []).append(profile)
+
+    return {members[0]: members for members in groups.values()}
+
+
+###############################################################################
+# Stopword filtering                                                          #
+###############################################################################
+# Stopword lists that can be chosen by name. Add an entry to use another list
+stopword_vocabularies = {'embed': frozenset(['a', 'to', 'of', 'and']),
+                         'summary': frozenset(['a', 'an', 'to', 'of', 'and',
+                                               'it'])}
+
+
+class StopwordFilter:
+    '''Removes stopwords from tokenized comments using a frozenset.
+
+    Parameters
+    ----------
+    stopwords : str naming one of stopword_vocabularies, or a list of words
+    '''
+    def __init__(self, stopwords='embed'):
+        if isinstance(stopwords, str):
+            stopwords = stopword_vocabularies[stopwords]
+        self.stopwords = frozenset(stopwords)
+
+    def __call__(self, tokens):
+        '''Returns a list of the tokens that are not stopwords'''
+        stopwords = self.stopwords
+        return [word for word in tokens if word not in stopwords]
+
+    def filter(self, sentences):
+        '''Yields each tokenized sentence with the stopwords removed, one at
+        a time so the sentences are never all held in memory'''
+        for tokens in sentences:
+            yield self(tokens)
+
+    def filter_flat(self, sentences):
+        '''Removes stopwords from every sentence and returns all the tokens
+        in one array. Sentence i is tokens[offsets[i]:offsets[i + 1]].
+
+        Returns
+        -------
+        tokens : numpy object array of tokens
+        offsets : numpy int64 array with one more item than the sentences
+        '''
+        tokens = []
+        lengths = []
+        for filtered in self.filter(sentences):
+            tokens.extend(filtered)
+            lengths.append(len(filtered))
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return _to_container(tokens, 'ndarray'), offsets
+
+
+embed_stopwords = StopwordFilter('embed')
 
 
 def remove_stopwords(sentences):
@@ -124,132 +471,409 @@ def remove_stopwords(sentences):
     -------
     x : list of words with stop words removed
     '''
-    to_remove = ['a', 'to', 'of', 'and']
+    return list(embed_stopwords.filter(sentences))
 
-    sentences_re = [[word for word in sentence if word not in to_remove]
-                    for sentence in sentences]
 
-    return sentences_re
+###############################################################################
+# Batch preprocessing of whole columns                                        #
+###############################################################################
+# Joins the comments in a chunk so each stage runs once per chunk. None of the
+# cleaning rules, misspellings or digit runs can match across this character
+_batch_sep = '\x00'
 
 
-def preprocess_for_embed(text, embeddings_index, split=True):
-    '''Preprocess text data from a dataframe based on the pretrained embedding
+def _to_container(values, output):
+    '''Converts a list of strings or token lists to the output container'''
+    if output == 'list':
+        return values
+
+    if output == 'ndarray':
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    if output == 'arrow':
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("output='arrow' requires pyarrow to be "
+                              "installed")
+        return pa.array(values)
+
+    raise ValueError("output must be 'list', 'ndarray' or 'arrow'")
+
+
+def _normalize_chunks(normalizer, comments, chunksize):
+    processed = []
+    for start in range(0, len(comments), chunksize):
+        chunk = comments[start:start + chunksize]
+        joined = _batch_sep.join(chunk)
+
+        # Fall back to one comment at a time if the separator is in the text
+        if joined.count(_batch_sep) != len(chunk) - 1:
+            processed.extend(normalizer(x) for x in chunk)
+        else:
+            processed.extend(normalizer(joined).split(_batch_sep))
+
+    return processed
+
+
+def iter_batch(text, profile, split=True, chunksize=10000):
+    '''Yields the preprocessed comments one at a time. Comments are still
+    preprocessed a chunk at a time, but only one chunk is held in memory so
+    the result can be passed straight to build_vocab or a Keras tokenizer.
 
     Parameters
     ----------
-    text : Pandas series object
-    embeddings_index: The name of the pretrained embedding
+    text : iterable of comments, for example a Pandas series
+    profile : str, the name of the pretrained embedding or 'bow'
+    split : bool, tokenize comments and remove stopwords
+    chunksize : int, number of comments preprocessed together
+
+    Yields
+    ------
+    text : preprocessed comment, or list of tokens when split is True
+    '''
+    normalizer = get_normalizer(profile)
+    comments = iter(text)
+
+    while True:
+        chunk = [str(x) for x in itertools.islice(comments, chunksize)]
+        if not chunk:
+            return
+
+        processed = _normalize_chunks(normalizer, chunk, chunksize)
+        if split:
+            yield from embed_stopwords.filter(x.split() for x in processed)
+        else:
+            yield from processed
+
+
+def preprocess_batch(text, profile, split=True, output='list',
+                     chunksize=10000, n_workers=1, cache=None):
+    '''Preprocess a whole column of comments with the normalizer for the
+    profile. Comments are joined into chunks so the translate table and regex
+    run once per chunk instead of once per comment. Gives the same result as
+    preprocess_for_embed, or preprocess_for_bow when profile is 'bow'.
+
+    Parameters
+    ----------
+    text : Pandas series, list or numpy array of comments
+    profile : str, the name of the pretrained embedding or 'bow'
+    split : bool, tokenize comments and remove stopwords
+    output : str, the container to return: 'list', 'ndarray' or 'arrow'
+    chunksize : int, number of comments joined together in each chunk
+    n_workers : int, number of processes, see preprocess_profiles
+    cache : PreprocessingCache, reuse comments preprocessed by earlier runs
 
     Returns
     -------
-    text : list of tokenized words for each comment
+    text : preprocessed comments, or lists of tokens when split is True
     '''
-    if embeddings_index in ['glove_wiki', 'glove_twitter', 'w2v_base_model']:
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x)) \
-                   .apply(lambda x: clean_numbers(x)) \
-                   .apply(lambda x: x.lower())
+    if n_workers != 1 or cache is not None:
+        return preprocess_profiles(text, [profile], split, output, chunksize,
+                                   n_workers, cache)[profile]
 
-        if split:
-            text = remove_stopwords(text.str.split())
-        return text
+    comments = [str(x) for x in text]
+    processed = _normalize_chunks(get_normalizer(profile), comments,
+                                  chunksize)
 
-    if embeddings_index == 'w2v_google_news':
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x)) \
-                   .apply(lambda x: clean_numbers(x))
+    if split:
+        processed = remove_stopwords(x.split() for x in processed)
 
-        if split:
-            text = remove_stopwords(text.str.split())
-        return text
+    return _to_container(processed, output)
 
-    else:
-        text = text.apply(lambda x: clean_text(x)) \
-                   .apply(lambda x: replace_typical_misspell(x))
+
+def _preprocess_shard(shard):
+    comments, profile, split, chunksize = shard
+    return preprocess_batch(comments, profile, split, 'list', chunksize)
+
+
+def _preprocess_shards(comments, split, chunksize, n_workers):
+    '''Preprocess a list of comments for each profile in a dictionary and
+    returns a dictionary of lists in the same order'''
+    if n_workers == 1:
+        return {profile: preprocess_batch(values, profile, split, 'list',
+                                          chunksize)
+                for profile, values in comments.items()}
+
+    # A few shards per worker keeps the processes busy when shards finish
+    # at different times
+    shards = []
+    for profile, values in comments.items():
+        shardsize = max(chunksize, -(-len(values) // (n_workers * 4)))
+        for start in range(0, len(values), shardsize):
+            shards.append((values[start:start + shardsize], profile, split,
+                           chunksize))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(_preprocess_shard, shards)
+
+        processed = {profile: [] for profile in comments}
+        for shard, result in zip(shards, results):
+            processed[shard[1]].extend(result)
+
+    return processed
+
+
+def preprocess_profiles(text, profiles, split=True, output='list',
+                        chunksize=10000, n_workers=None, cache=None):
+    '''Preprocess a column of comments for several profiles at once. The
+    comments are split into shards and every (shard, profile) pair runs in a
+    pool of processes. Results are put back together in the original order
+    so they are identical to calling preprocess_batch for each profile.
+
+    Parameters
+    ----------
+    text : Pandas series, list or numpy array of comments
+    profiles : list of str, the names of the embeddings or 'bow'
+    split : bool, tokenize comments and remove stopwords
+    output : str, the container to return: 'list', 'ndarray' or 'arrow'
+    chunksize : int, number of comments joined together in each chunk
+    n_workers : int, number of processes. The default uses every CPU and
+        1 runs serially in the current process
+    cache : PreprocessingCache, only comments missing from the cache are
+        preprocessed and then added to it
+
+    Returns
+    -------
+    text : dict with the preprocessed comments for each profile
+    '''
+    comments = [str(x) for x in text]
+    n_workers = n_workers or os.cpu_count() or 1
+    if len(comments) <= chunksize:
+        n_workers = 1
+
+    if cache is None:
+        processed = _preprocess_shards({profile: comments
+                                        for profile in profiles},
+                                       split, chunksize, n_workers)
+        return {profile: _to_container(processed[profile], output)
+                for profile in profiles}
+
+    # Look up every comment in the cache and preprocess the rest
+    cached = {}
+    missing = {}
+    for profile in profiles:
+        cached[profile] = cache.get_many(*_cache_profile(profile), comments)
+        missing[profile] = [comment for comment, value
+                            in zip(comments, cached[profile]) if value is None]
+
+    normalized = _preprocess_shards(missing, False, chunksize, n_workers)
+
+    processed = {}
+    for profile in profiles:
+        cache.put_many(*_cache_profile(profile), missing[profile],
+                       normalized[profile])
+
+        new_values = iter(normalized[profile])
+        values = [next(new_values) if value is None else value
+                  for value in cached[profile]]
 
         if split:
-            text = remove_stopwords(text.str.split())
-        return text
+            values = remove_stopwords(x.split() for x in values)
+        processed[profile] = _to_container(values, output)
 
+    return processed
 
-def preprocess_for_bow(text):
-    '''Preprocess text data for the bag of words model
+
+def preprocess_for_embed(text, embeddings_index, split=True):
+    '''Preprocess text data from a dataframe based on the pretrained embedding
 
     Parameters
     ----------
     text : Pandas series object
+    embeddings_index: The name of the pretrained embedding
 
     Returns
     -------
-    text : numpy array
+    text : list of tokenized words for each comment
     '''
-    text = text.apply(lambda x: clean_text(x)) \
-               .apply(lambda x: replace_typical_misspell(x)) \
-               .apply(lambda x: x.lower())
+    if split:
+        return preprocess_batch(text, embeddings_index)
 
-    return np.array(text)
+    return pd.Series(preprocess_batch(text, embeddings_index, split=False),
+                     index=text.index)
 
 
-def balance_themes(X, Y):
-    '''Balances arrays to have roughly the same number of comments for each
-    class
+def preprocess_for_bow(text, cache=None, n_workers=1):
+    '''Preprocess text data for the bag of words model
 
     Parameters
     ----------
-    X : numpy array with comment text
+    text : Pandas series object
+    cache : PreprocessingCache, optional cache of preprocessed comments
+    n_workers : int, number of processes
 
     Returns
     -------
+    text : numpy array
+    '''
+    return preprocess_batch(text, 'bow', split=False, output='ndarray',
+                            n_workers=n_workers, cache=cache)
+
+
+def balance_theme_indices(Y, random_state=None):
+    '''Returns the row indices that balance the themes. Every row is kept
+    once and for each theme, rows with that label are sampled with
+    replacement until the theme has as many comments as the largest theme.
+
+    Parameters
+    ----------
     Y : numpy array with comment labels
+    random_state : int or numpy RandomState, the default uses np.random
+
+    Returns
+    -------
+    index : numpy array of row indices
     '''
+    if random_state is None:
+        rng = np.random
+    elif isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    Y = np.asarray(Y)
     counts = np.sum(Y, axis=0)
 
+    index = [np.arange(Y.shape[0])]
     for i in range(Y.shape[1]):
+        if counts[i] == 0:
+            continue
 
-        X_labeled = X[Y[:, i] == 1, :]
-        Y_labeled = Y[Y[:, i] == 1, :]
+        labeled = np.flatnonzero(Y[:, i] == 1)
+        sample = rng.randint(low=0, high=counts[i],
+                             size=max(counts) - counts[i])
+        index.append(labeled[sample])
 
-        index = np.random.randint(low=0, high=counts[i],
-                                  size=max(counts) - counts[i])
-        X_array_to_append = X_labeled[index, :]
-        Y_array_to_append = Y_labeled[index, :]
+    return np.concatenate(index)
 
-        if i == 0:
-            X_balance = X
-            Y_balance = Y
 
-        X_balance = np.vstack((X_balance, X_array_to_append))
-        Y_balance = np.vstack((Y_balance, Y_array_to_append))
+def balance_themes(X, Y, random_state=None, indices_only=False):
+    '''Balances arrays to have roughly the same number of comments for each
+    class. The rows are gathered once from the indices given by
+    balance_theme_indices, so X can be a numpy array of padded sequences or
+    a scipy.sparse CSR matrix.
 
-    return X_balance, Y_balance
+    Parameters
+    ----------
+    X : numpy array or scipy.sparse matrix with comment features
+    Y : numpy array with comment labels
+    random_state : int or numpy RandomState, the default uses np.random
+    indices_only : bool, return the row indices instead of copying the rows,
+        for example to draw batches from in a Keras generator
+
+    Returns
+    -------
+    X : balanced comment features
+    Y : balanced comment labels
+    '''
+    index = balance_theme_indices(Y, random_state)
+    if indices_only:
+        return index
+
+    return X[index], np.asarray(Y)[index]
 
 
 def build_vocab(sentences, verbose=True):
-    vocab = {}
-    for sent in tqdm(sentences, disable=(not verbose)):
-        for word in sent:
-            try:
-                vocab[word] += 1
-            except KeyError:
-                vocab[word] = 1
+    '''Counts how often each word appears in tokenized sentences
+
+    Parameters
+    ----------
+    sentences : iterable of lists of words, for example from iter_batch
+    verbose : bool, show a progress bar
+
+    Returns
+    -------
+    vocab : Counter with the count of each word
+    '''
+    sentences = tqdm(sentences, disable=(not verbose))
+    return Counter(itertools.chain.from_iterable(sentences))
+
+
+def _count_shard(shard):
+    comments, profile, chunksize = shard
+    return Counter(itertools.chain.from_iterable(
+        iter_batch(comments, profile, chunksize=chunksize)))
+
+
+def count_vocab(text, profile, n_workers=None, chunksize=10000):
+    '''Preprocesses comments and counts the words in a pool of processes.
+    Each process counts one shard of the comments and the counts are added
+    together at the end.
+
+    Parameters
+    ----------
+    text : Pandas series, list or numpy array of comments
+    profile : str, the name of the pretrained embedding or 'bow'
+    n_workers : int, number of processes. The default uses every CPU
+    chunksize : int, number of comments preprocessed together
+
+    Returns
+    -------
+    vocab : Counter with the count of each word
+    '''
+    comments = [str(x) for x in text]
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if n_workers == 1 or len(comments) <= chunksize:
+        return _count_shard((comments, profile, chunksize))
+
+    shardsize = max(chunksize, -(-len(comments) // (n_workers * 4)))
+    shards = [(comments[start:start + shardsize], profile, chunksize)
+              for start in range(0, len(comments), shardsize)]
+
+    vocab = Counter()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for counts in executor.map(_count_shard, shards):
+            vocab.update(counts)
+
     return vocab
 
 
+def _embedding_keys(embeddings_index):
+    # Word to index mapping of gensim 4, gensim 3 or a plain dictionary
+    for attribute in ['key_to_index', 'vocab']:
+        if hasattr(embeddings_index, attribute):
+            return getattr(embeddings_index, attribute)
+    return embeddings_index
+
+
 def check_coverage(vocab, embeddings_index):
-    a = {}
-    oov = {}
-    k = 0
-    i = 0
-    for word in tqdm(vocab):
-        try:
-            a[word] = embeddings_index[word]
-            k += vocab[word]
-        except:
-            oov[word] = vocab[word]
-            i += vocab[word]
-            pass
-
-    vocab_coverage = len(a) / len(vocab)
+    '''Checks how much of a vocabulary is in a pretrained embedding. The
+    words missing from the embedding are found with one set difference
+    against the embedding's index of words instead of looking up each
+    vector.
+
+    Parameters
+    ----------
+    vocab : dict with the count of each word, from build_vocab
+    embeddings_index : gensim KeyedVectors, EmbeddingStore or dict of word
+        vectors
+
+    Returns
+    -------
+    vocab_coverage : fraction of the words in the embedding
+    text_coverage : fraction of the word counts in the embedding
+    sorted_x : list of (word, count) not in the embedding, most common first
+    '''
+    if hasattr(embeddings_index, 'lookup'):
+        # Embedding store, all the words are looked up at once
+        words = list(vocab)
+        rows = embeddings_index.lookup(words)
+        missing = {word for word, row in zip(words, rows) if row < 0}
+    else:
+        # One set difference of the key views, each vocabulary word is
+        # looked up in the embedding's index in C
+        missing = vocab.keys() - _embedding_keys(embeddings_index).keys()
+
+    # In the order of the vocabulary so ties are sorted as before
+    oov = {word: count for word, count in vocab.items() if word in missing}
+    i = sum(oov.values())
+    k = sum(vocab.values()) - i
+
+    vocab_coverage = (len(vocab) - len(oov)) / len(vocab)
     text_coverage = k / (k + i)
     sorted_x = sorted(oov.items(), key=operator.itemgetter(1))[::-1]
 
@@ -0,0 +1,264 @@
+# qual_dataset.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script defines functions to save the qualitative comments in the Arrow
+# IPC columnar format and to read them back. The file has three typed columns:
+# USERID, the comment text and the 12 theme labels packed into 2 bytes per
+# comment. The schema metadata holds a format version and the theme names.
+# Arrow files are memory mapped, so a stage only reads the columns it needs.
+# The read functions also accept the original csv files.
+# A split index file assigns every row of the data to a fold, so the train
+# and test sets are read from the single data file instead of copies of it.
+
+# Import modules
+import os
+import numpy as np
+import pandas as pd
+
+# Bump when the layout of the file changes
+dataset_version = '1'
+
+theme_names = ['CPD', 'CB', 'EWC', 'Exec', 'FWE', 'SP', 'RE', 'Sup', 'SW',
+               'TEPE', 'VMG', 'OTH']
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError('Reading and writing arrow files requires pyarrow '
+                          'to be installed')
+    return pa
+
+
+def _to_table(df):
+    '''Converts a dataframe with the layout of the desensitized csv to an
+    arrow table with the USERID, comment and packed theme columns'''
+    pa = _import_pyarrow()
+
+    labels = np.array(df.loc[:, "CPD":"OTH"], dtype=np.uint8)
+    if labels.shape[1] != len(theme_names):
+        raise ValueError('expected %d theme columns from CPD to OTH, found %d'
+                         % (len(theme_names), labels.shape[1]))
+
+    n_bytes = -(-len(theme_names) // 8)
+    packed = np.packbits(labels, axis=1)
+    themes = pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(n_bytes), len(df), [None, pa.py_buffer(packed.tobytes())])
+
+    metadata = {'wes_dataset_version': dataset_version,
+                'themes': ','.join(theme_names)}
+    table = pa.table({'USERID': pa.array(df.iloc[:, 0].astype(str),
+                                         type=pa.string()),
+                      'comment': pa.array(df.iloc[:, 1], type=pa.string()),
+                      'themes': themes}).replace_schema_metadata(metadata)
+
+    return table
+
+
+def write_dataset(df, filepath):
+    '''Writes the USERID, comment and theme label columns of a dataframe with
+    the layout of the desensitized csv to an Arrow IPC file
+
+    Parameters
+    ----------
+    df : dataframe with USERID and comment in the first two columns and the
+        theme labels in the columns CPD to OTH, or an iterable of such
+        dataframes which are written one at a time
+    filepath : str, path of the arrow file, only replaced once every chunk
+        has been written
+    '''
+    pa = _import_pyarrow()
+
+    chunks = [df] if isinstance(df, pd.DataFrame) else df
+    writer = None
+    partial = os.path.join(os.path.dirname(filepath) or '.',
+                           '.partial-' + os.path.basename(filepath))
+    try:
+        with pa.OSFile(partial, 'wb') as sink:
+            for chunk in chunks:
+                table = _to_table(chunk)
+                if writer is None:
+                    writer = pa.ipc.new_file(sink, table.schema)
+                writer.write_table(table)
+            if writer is None:
+                raise ValueError('no rows to write to %s' % filepath)
+            writer.close()
+        os.replace(partial, filepath)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def read_dataset(filepath):
+    '''Memory maps an arrow file written by write_dataset and checks its
+    version. Columns are only read from disk when they are used.
+
+    Parameters
+    ----------
+    filepath : str, path of the arrow file
+
+    Returns
+    -------
+    table : pyarrow Table
+    '''
+    pa = _import_pyarrow()
+
+    table = pa.ipc.open_file(pa.memory_map(filepath, 'r')).read_all()
+    metadata = table.schema.metadata or {}
+    version = metadata.get(b'wes_dataset_version', b'').decode()
+    if version != dataset_version:
+        raise ValueError('%s has dataset version %r, expected %r'
+                         % (filepath, version, dataset_version))
+
+    return table
+
+
+def write_split_index(filepath, folds, n_folds, test_fold=0, seed=None):
+    '''Saves the fold of every row of a data file
+
+    Parameters
+    ----------
+    filepath : str, path of the npz file
+    folds : array with the fold of each row, in the order of the data file
+    n_folds : int, number of folds
+    test_fold : int, the fold held out as the test set
+    seed : int, random seed used to make the split
+    '''
+    np.savez(filepath, folds=np.asarray(folds, dtype=np.int8),
+             n_folds=n_folds, test_fold=test_fold,
+             seed=-1 if seed is None else seed,
+             split_version=dataset_version)
+
+
+def read_split_index(filepath):
+    '''Returns the fold of every row, the number of folds and the test fold
+    from a file written by write_split_index'''
+    with np.load(filepath) as index:
+        return (index['folds'], int(index['n_folds']),
+                int(index['test_fold']))
+
+
+def split_mask(filepath_index, subset):
+    '''Returns a boolean mask of the rows in a subset of the split.
+
+    The subset is 'train' or 'test', a fold number such as '3' for the rows
+    of that fold, or 'train-3' for the training rows except fold 3. The last
+    two are used for cross validation on the training rows.
+    '''
+    folds, n_folds, test_fold = read_split_index(filepath_index)
+    subset = str(subset)
+
+    if subset == 'test':
+        return folds == test_fold
+    if subset == 'train':
+        return folds != test_fold
+    if subset.startswith('train-'):
+        fold = int(subset[len('train-'):])
+        return (folds != test_fold) & (folds != fold)
+    if subset.isdigit() and int(subset) < n_folds:
+        return folds == int(subset)
+
+    raise ValueError("subset must be 'train', 'test', a fold number or "
+                     "'train-<fold>', got %r" % subset)
+
+
+def _is_arrow(filepath):
+    return str(filepath).endswith(('.arrow', '.feather'))
+
+
+def _read_csv_rows(filepath, columns, mask, chunksize):
+    '''Reads the rows of a csv selected by a mask, one chunk at a time so
+    only the selected rows are kept in memory'''
+    chunks = []
+    n_rows = 0
+    for chunk in pd.read_csv(filepath, usecols=columns, chunksize=chunksize):
+        chunk = chunk[columns]
+        chunks.append(chunk[mask[n_rows:n_rows + len(chunk)]])
+        n_rows += len(chunk)
+
+    _check_rows(filepath, n_rows, mask)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _check_rows(filepath, n_rows, mask):
+    if n_rows != len(mask):
+        raise ValueError('%s has %d rows but the split index has %d'
+                         % (filepath, n_rows, len(mask)))
+
+
+def _label_columns(filepath):
+    columns = pd.read_csv(filepath, nrows=0).columns
+    return list(columns[columns.get_loc('CPD'):columns.get_loc('OTH') + 1])
+
+
+def read_comments(filepath, split_index=None, subset='train',
+                  chunksize=100000):
+    '''Returns the comments from an arrow file or csv file
+
+    Parameters
+    ----------
+    filepath : str, path of the arrow or csv file
+    split_index : str, optional path of a split index file for the rows of
+        filepath. If given only the rows in subset are returned.
+    subset : str, the rows to return, see split_mask
+    chunksize : int, number of csv rows to read at a time
+
+    Returns
+    -------
+    comments : Pandas series object
+    '''
+    mask = split_mask(split_index, subset) if split_index else None
+
+    if _is_arrow(filepath):
+        column = read_dataset(filepath).column('comment')
+        if mask is not None:
+            _check_rows(filepath, len(column), mask)
+            column = column.take(np.flatnonzero(mask))
+        return column.to_pandas()
+
+    if mask is None:
+        return pd.read_csv(filepath).iloc[:, 1]
+
+    column = pd.read_csv(filepath, nrows=0).columns[1]
+    return _read_csv_rows(filepath, [column], mask, chunksize).iloc[:, 0]
+
+
+def read_labels(filepath, split_index=None, subset='train',
+                chunksize=100000):
+    '''Returns the theme labels from an arrow file or csv file
+
+    Parameters
+    ----------
+    filepath : str, path of the arrow or csv file
+    split_index : str, optional path of a split index file for the rows of
+        filepath. If given only the rows in subset are returned.
+    subset : str, the rows to return, see split_mask
+    chunksize : int, number of csv rows to read at a time
+
+    Returns
+    -------
+    Y : numpy array with a column for each theme from CPD to OTH
+    '''
+    mask = split_mask(split_index, subset) if split_index else None
+
+    if not _is_arrow(filepath):
+        if mask is None:
+            return np.array(pd.read_csv(filepath).loc[:, "CPD":"OTH"])
+        return np.array(_read_csv_rows(filepath, _label_columns(filepath),
+                                       mask, chunksize))
+
+    themes = read_dataset(filepath).column('themes').combine_chunks()
+    width = themes.type.byte_width
+    packed = np.frombuffer(themes.buffers()[1], dtype=np.uint8,
+                           offset=themes.offset * width,
+                           count=len(themes) * width)
+    packed = packed.reshape(len(themes), width)
+    if mask is not None:
+        _check_rows(filepath, len(packed), mask)
+        packed = packed[mask]
+
+    return np.unpackbits(packed, axis=1)[:, :len(theme_names)]
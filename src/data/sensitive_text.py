@@ -17,7 +17,10 @@
 python src/data/sensitive_text.py \
 --input_xlsx data/raw/2018\ WES\ Qual\ Coded\ -\ Final\ Comments\ and\ Codes.xlsx \
 --output_csv data/interim/desensitized_qualitative-data2018.csv \
---skiprows 1
+--skiprows 1 \
+--chunksize 10000 \
+--n_process 4 \
+--verdicts data/interim/sensitive_verdicts.sqlite3
 '''
 
 # USAGE for Sample Data:
@@ -30,10 +33,21 @@ python src/data/sensitive_text.py \
 
 
 # Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import re
+import pickle
+import hashlib
+import inspect
 import pandas as pd
 import spacy
 import argparse
 import numpy as np
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+from src.data.preprocessing_cache import PreprocessingCache
 
 # Default File paths:
 filepath_in = "data/raw/2018 WES Qual Coded - Final Comments and Codes.xlsx"
@@ -56,21 +70,41 @@ def get_arguments():
                         action='store', default='1',
                         help='Number of rows to skip when reading xlsx')
 
+    parser.add_argument('--chunksize', '-c', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='Number of rows to read from the xlsx at a time')
+
+    parser.add_argument('--batch_size', '-b', type=int, dest='batch_size',
+                        action='store', default=1000,
+                        help='Number of comments in each spaCy batch')
+
+    parser.add_argument('--n_process', '-n', type=int, dest='n_process',
+                        action='store', default=1,
+                        help='Number of processes for named entity '
+                        'recognition')
+
+    parser.add_argument('--no_prefilter', dest='prefilter',
+                        action='store_false',
+                        help='Run named entity recognition on every comment, '
+                        'not only those containing a name')
+
+    parser.add_argument('--verdicts', '-v', type=str, dest='verdicts',
+                        action='store', default=None,
+                        help='the SQLite file of verdicts from earlier runs, '
+                        'only new or edited comments are scanned')
+
     args = parser.parse_args()
     return args
 
 
 ###############################################################################
-# Create name_check list based on US Census data to be used in the            #
+# Create name_check set based on US Census data to be used in the             #
 # sensitive_text function                                                     #
 ###############################################################################
 
-# File Paths to read in datadictionary
+# File Paths to read in datadictionary and the prebuilt set of names
 filepath_names = "./references/data-dictionaries/NationalNames.csv"
-
-# Read in data dictionary
-df_names = pd.read_csv(filepath_names)
-name_check = df_names.Name.unique().tolist()
+filepath_names_cache = "./data/interim/national_names.pickle"
 
 # Names that are in the names list and NER labels as Person, but are not
 # actually sensitive. ie. they are false positives
@@ -79,64 +113,527 @@ false_names = ['Sheriff', 'Law', 'Child', 'Warden', 'Care', 'Cloud', 'Honesty',
                'Branch', 'Field', 'Langford', 'Surrey', 'Cap', 'Lean', 'Van',
                'Case', 'Min', 'Merit', 'Job', 'Win', 'Forest', 'Victoria']
 
-# Drop the false_names from the names list
-name_check = list(set(name_check).difference(set(false_names)))
-
 # Names that are not in the names list, but should be! ie. false negatives
 missing_names = ['Kristofferson']
 
-# Add missing names
-for missing_name in missing_names:
-    name_check.append(missing_name)
+# Runs of letters, the names are searched for inside these
+letter_run_re = re.compile(r'[^\W\d_]+')
+
+
+class NameDictionary:
+    """Set of first names used to confirm the PERSON entities.
+
+    The names are read from the csv the first time the dictionary is used,
+    not when the module is imported. The unique names are saved to a pickle
+    next to the interim data and reloaded from it while the csv is unchanged.
+    false_names and missing_names are applied on every load, so editing them
+    does not require rebuilding the pickle.
+
+    Parameters
+    ----------
+    filepath : str, path to NationalNames.csv
+    filepath_cache : str, path to the pickled set of names, or None to always
+        read the csv
+    false_names : list of names to remove from the dictionary
+    missing_names : list of names to add to the dictionary
+    """
+    def __init__(self, filepath=filepath_names,
+                 filepath_cache=filepath_names_cache,
+                 false_names=false_names, missing_names=missing_names):
+        self.filepath = filepath
+        self.filepath_cache = filepath_cache
+        self.false_names = false_names
+        self.missing_names = missing_names
+        self._names = None
+        self._prefixes = None
+        self._irregular = None
+
+    def _source_stamp(self):
+        stat = os.stat(self.filepath)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _read_cache(self, stamp):
+        try:
+            with open(self.filepath_cache, 'rb') as f:
+                cached = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError):
+            return None
+
+        # A stale or foreign pickle at the path is rebuilt like an old one
+        if not (isinstance(cached, dict) and 'names' in cached):
+            return None
+        if cached.get('source') != stamp:
+            return None
+        return cached['names']
+
+    def _write_cache(self, stamp, names):
+        # Write to a temporary file first so a reader never sees half a file
+        filepath_tmp = self.filepath_cache + '.tmp'
+        try:
+            with open(filepath_tmp, 'wb') as f:
+                pickle.dump({'source': stamp, 'names': names}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(filepath_tmp, self.filepath_cache)
+        except OSError:
+            pass
+
+    def _load_base(self):
+        """Returns the names in the csv, using the pickle when it is current"""
+        stamp = self._source_stamp()
+        if self.filepath_cache is not None:
+            names = self._read_cache(stamp)
+            if names is not None:
+                return names
+
+        df_names = pd.read_csv(self.filepath, usecols=['Name'])
+        names = frozenset(df_names.Name.dropna().unique())
+
+        if self.filepath_cache is not None:
+            self._write_cache(stamp, names)
+        return names
+
+    @property
+    def names(self):
+        if self._names is None:
+            base = self._load_base()
+            self._names = ((base - frozenset(self.false_names))
+                           | frozenset(self.missing_names))
+        return self._names
+
+    def _build_prefixes(self):
+        """Splits the names into those made of letters that start with a
+        capital, indexed by all their prefixes, and the irregular rest"""
+        prefixes = set()
+        irregular = []
+        for name in self.names:
+            if name.isalpha() and name[0].isupper():
+                prefixes.update(name[:i] for i in range(1, len(name) + 1))
+            else:
+                irregular.append(name)
+
+        self._prefixes = frozenset(prefixes)
+        self._irregular = irregular
+
+    def occurs_in(self, text):
+        """Returns True if any name appears anywhere in the text.
+
+        Every word of a PERSON entity is a piece of the comment text, so a
+        comment for which this is False can never be confirmed as sensitive.
+        The search walks each capital letter forward through the prefix set
+        and stops as soon as no name starts with the letters seen so far."""
+        if self._prefixes is None:
+            self._build_prefixes()
+        prefixes = self._prefixes
+        names = self.names
+
+        for match in letter_run_re.finditer(text):
+            run = match.group()
+            if run.islower():
+                continue
+            for i, char in enumerate(run):
+                if not char.isupper():
+                    continue
+                for j in range(i + 1, len(run) + 1):
+                    piece = run[i:j]
+                    if piece not in prefixes:
+                        break
+                    if piece in names:
+                        return True
+
+        return any(name in text for name in self._irregular)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+
+name_check = NameDictionary()
 
 
 ###############################################################################
 # Define functions and set up script to run in command line                   #
 ###############################################################################
-def find_sensitive_text(comments):
+class SensitiveTextDetector:
+    """Finds comments that mention a person's name.
+
+    The spaCy model is loaded once with only the components the named entity
+    recognizer needs, and comments are streamed through nlp.pipe in batches.
+    With n_process > 1 spaCy splits the batches across worker processes.
+
+    Parameters
+    ----------
+    model : str, name of the spaCy model
+    batch_size : int, number of comments in each nlp.pipe batch
+    n_process : int, number of processes used by nlp.pipe
+    prefilter : bool, only run NER on comments that contain a name from
+        name_check. The other comments cannot be confirmed as sensitive, so
+        the result is the same.
+    store : PreprocessingCache, optional store of the verdicts from earlier
+        runs. Only comments that are not in the store are scanned. The
+        verdicts are keyed by the comment text and the fingerprint, so they
+        are discarded when the model, spaCy or the names change.
+    """
+    store_profile = 'sensitive_text'
+
+    def __init__(self, model="en_core_web_sm", batch_size=1000, n_process=1,
+                 prefilter=True, store=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.prefilter = prefilter
+        self.store = store
+        self.n_comments = 0
+        self.n_skipped = 0
+        self.n_stored = 0
+        self._fingerprint = None
+
+        self.nlp = spacy.load(model)
+        unused = self._unused_pipes(self.nlp)
+        if unused and hasattr(self.nlp, 'select_pipes'):
+            self.nlp.select_pipes(disable=unused)
+        elif unused:
+            self.nlp.disable_pipes(*unused)
+
+    @staticmethod
+    def _unused_pipes(nlp):
+        """Names of the components that are not the NER or the shared
+        token-to-vector layers the NER listens to"""
+        keep = {'ner'}
+        for name in nlp.pipe_names:
+            listeners = getattr(nlp.get_pipe(name), 'listening_components',
+                                [])
+            if 'ner' in listeners:
+                keep.add(name)
+
+        return [name for name in nlp.pipe_names if name not in keep]
+
+    def iter_persons(self, comments):
+        """Yield the index and text of each PERSON entity in the comments"""
+        docs = self.nlp.pipe((str(comment) for comment in comments),
+                             batch_size=self.batch_size,
+                             n_process=self.n_process)
+        for index, doc in enumerate(docs):
+            for ent in doc.ents:
+                if ent.label_ == "PERSON":
+                    yield index, ent.text
+
+    @property
+    def fingerprint(self):
+        """Hash of everything a verdict depends on: the spaCy and model
+        versions, the names after false_names and missing_names are applied
+        and the code of this class"""
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            for part in [self.model, spacy.__version__,
+                         self.nlp.meta.get('version', ''),
+                         inspect.getsource(SensitiveTextDetector)]:
+                h.update(str(part).encode('utf-8') + b'\x00')
+            for name in sorted(name_check.names):
+                h.update(name.encode('utf-8') + b'\n')
+            self._fingerprint = h.hexdigest()
+
+        return self._fingerprint
+
+    def count_sensitive(self, comments):
+        """Return the number of PERSON entities in each comment that contain
+        a word from the name dictionary"""
+        if self.prefilter:
+            candidates = [index for index, comment in enumerate(comments)
+                          if name_check.occurs_in(comment)]
+        else:
+            candidates = list(range(len(comments)))
+        self.n_skipped += len(comments) - len(candidates)
+
+        counts = [0] * len(comments)
+        persons = self.iter_persons(comments[index] for index in candidates)
+        for index, person in persons:
+            for name in person.split():
+                if name in name_check:
+                    counts[candidates[index]] += 1
+                    break
+
+        return counts
+
+    def __call__(self, comments):
+        """Return the position of the comment for each PERSON entity that
+        contains a word from the name dictionary"""
+        comments = [str(comment) for comment in comments]
+        self.n_comments += len(comments)
+
+        if self.store is None:
+            counts = self.count_sensitive(comments)
+        else:
+            counts = self.store.get_many(self.store_profile, self.fingerprint,
+                                         comments)
+            missing = [index for index, count in enumerate(counts)
+                       if count is None]
+            self.n_stored += len(comments) - len(missing)
+
+            new_comments = [comments[index] for index in missing]
+            new_counts = self.count_sensitive(new_comments)
+            for index, count in zip(missing, new_counts):
+                counts[index] = count
+            self.store.put_many(self.store_profile, self.fingerprint,
+                                new_comments, [str(x) for x in new_counts])
+
+        sensitive_person_index = []
+        for index, count in enumerate(counts):
+            sensitive_person_index.extend([index] * int(count))
+
+        return sensitive_person_index
+
+
+def find_sensitive_text(comments, detector=None):
     """Return a list of indices identifying comments with sensitive information
-    given a list of comments"""
-
-    # Apply Named entity recognition on list of comments
-    nlp = spacy.load("en_core_web_sm")
-    docs = [nlp(str(comment)) for comment in comments]
-
-    # Create a list of the words tagged as PERSON and the original index
-    person_index = []
-    person_list = []
-    for index, doc in enumerate(docs):
-        for ent in doc.ents:
-            if ent.label_ == "PERSON":
-                person_index.append(index)
-                person_list.append(ent.text)
-
-    # Cross check a name dictionary to confirm names
-    sensitive_person = []
-    sensitive_person_index = []
-    for index, person in enumerate(person_list):
-        for name in person.split():
-            if name in name_check:
-                sensitive_person.append(person)
-                sensitive_person_index.append(person_index[index])
-                break
-
-    return sensitive_person_index
-
-
-def remove_sensitive_text(filepath, skiprows):
-
-    df = pd.read_excel(filepath, skiprows=skiprows)
-    df = df[df.iloc[:, 1].isnull() == False]
-    comments = df.iloc[:, 1]
-    sensitive_indices = find_sensitive_text(comments)
-    df = df.drop(index=sensitive_indices)
+    given a list of comments. The indices are positions in the list."""
+
+    if detector is None:
+        detector = SensitiveTextDetector()
+
+    return detector(comments)
+
+
+# Cell text that pd.read_excel reads as a missing value
+na_strings = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN',
+                        '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+                        'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+
+
+def _cell_value(cell):
+    """Convert a cell the same way as pd.read_excel, empty cells become ''
+    and error cells NaN, integral numbers become ints"""
+
+    if cell.value is None:
+        return ''
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def _iter_sheet_rows(filepath, skiprows):
+    """Yield the rows of the first sheet of an excel file as lists of cell
+    values without their trailing empty cells. Empty rows at the end of the
+    sheet are dropped, like pd.read_excel does."""
+
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        sheet = wb.worksheets[0]
+        sheet.reset_dimensions()
+        n_empty = 0
+        for i, row in enumerate(sheet.rows):
+            if i < skiprows:
+                continue
+            row = [_cell_value(cell) for cell in row]
+            while row and row[-1] == '':
+                row.pop()
+            if not row:
+                # Held back until a later row has data
+                n_empty += 1
+                continue
+            for _ in range(n_empty):
+                yield []
+            n_empty = 0
+            yield row
+    finally:
+        wb.close()
+
+
+def _iter_row_chunks(filepath, skiprows, chunksize):
+    """Yield the header row and then lists of at most chunksize rows"""
+
+    rows = _iter_sheet_rows(filepath, skiprows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_rows(header, rows, width):
+    """Parse rows the same way as pd.read_excel, with every row padded to the
+    same width"""
+
+    data = [row + [''] * (width - len(row)) for row in [header] + rows]
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+
+# Text that pd.read_excel might convert to a number or a bool, any other
+# text stays text
+maybe_number = re.compile(r'\s*(?:[-+.0-9]|inf|nan|true|false)', re.I)
+
+
+def _value_kind(value, kinds):
+    """Return the key of the kind of a cell value for pd.read_excel, values
+    of the same kind convert to the same dtype. kinds caches the kind of the
+    values that had to be parsed to find it."""
+
+    if isinstance(value, str):
+        if value in na_strings:
+            return 'na'
+        if not maybe_number.match(value):
+            return 'text'
+    elif isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, float):
+        return 'na' if value != value else 'float'
+    elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        return 'int'
+
+    key = (type(value), value)
+    if key not in kinds:
+        dtype = _parse_rows(['value'], [[value]], 1).iloc[:, 0].dtype
+        kinds[key] = (type(value).__name__, str(dtype))
+    return kinds[key]
+
+
+def _column_dtypes(filepath, skiprows, chunksize):
+    """Read the sheet once to find its width and the dtype pd.read_excel
+    gives each column over all the rows. The dtype only depends on the kinds
+    of values in the column, so it is the dtype of one value of each kind."""
+
+    chunks = _iter_row_chunks(filepath, skiprows, chunksize)
+    header = next(chunks, None)
+    if header is None:
+        return None, []
+
+    samples = []
+    kinds = {}
+    n_rows = 0
+    for rows in chunks:
+        for row in rows:
+            if len(row) > len(samples):
+                # Columns that start in this row were missing in earlier rows
+                samples.extend({'na': ''} if n_rows else {}
+                               for _ in range(len(row) - len(samples)))
+            for i, value in enumerate(row):
+                kind = _value_kind(value, kinds)
+                if kind not in samples[i]:
+                    samples[i][kind] = value
+            for column in samples[len(row):]:
+                column.setdefault('na', '')
+            n_rows += 1
+
+    width = max(len(header), len(samples))
+    samples.extend({'na': ''} if n_rows else {}
+                   for _ in range(width - len(samples)))
+    height = max([len(column) for column in samples] + [0])
+    rows = [[list(column.values())[min(j, len(column) - 1)] if column else ''
+             for column in samples] for j in range(height)]
+
+    return width, list(_parse_rows(header, rows, width).dtypes)
+
+
+def iter_excel_chunks(filepath, skiprows, chunksize=10000):
+    """Yield the first sheet of an excel file as dataframes of at most
+    chunksize rows. The workbook is opened in read only mode so the rows are
+    streamed from the file instead of loading the whole sheet.
+
+    The sheet is read twice. The first pass finds the dtype pd.read_excel
+    gives each column over the whole sheet, so a column of ints with a missing
+    value in any chunk is float in every chunk and the csv is the same as
+    from pd.read_excel."""
+
+    width, dtypes = _column_dtypes(filepath, skiprows, chunksize)
+    if width is None:
+        return
+
+    chunks = _iter_row_chunks(filepath, skiprows, chunksize)
+    header = next(chunks)
+    empty = True
+    for rows in chunks:
+        df = _parse_rows(header, rows, width)
+        for i, dtype in enumerate(dtypes):
+            column = df.iloc[:, i]
+            if column.dtype == dtype:
+                continue
+            if dtype.kind in 'biufcmM':
+                column = column.astype(dtype)
+            else:
+                # Text columns keep the cell values as they are, a chunk of
+                # numbers in them is not converted
+                values = [row[i] if i < len(row) else '' for row in rows]
+                column = pd.Series(values, dtype=object)
+                column = column.mask(column.isin(na_strings) |
+                                     column.isnull(), np.nan).astype(dtype)
+            df.isetitem(i, column)
+        empty = False
+        yield df
+
+    # An empty sheet still gives one chunk so the csv has a header
+    if empty:
+        df = _parse_rows(header, [], width)
+        yield df.astype(dict(zip(df.columns, dtypes)))
+
+
+def iter_desensitized_chunks(filepath, skiprows, chunksize=10000,
+                             detector=None, batch_size=1000, n_process=1):
+    """Yield chunks of the excel file with the empty and sensitive comments
+    removed. Without a detector one is made with batch_size and n_process,
+    a detector passed in keeps its own settings."""
+
+    if detector is None:
+        detector = SensitiveTextDetector(batch_size=batch_size,
+                                         n_process=n_process)
+
+    for df in iter_excel_chunks(filepath, skiprows, chunksize):
+        df = df[df.iloc[:, 1].notnull()]
+        sensitive_indices = detector(df.iloc[:, 1])
+        keep = np.ones(len(df), dtype=bool)
+        keep[sensitive_indices] = False
+
+        yield df[keep]
+
+
+def remove_sensitive_text(filepath, skiprows, chunksize=10000, detector=None,
+                          batch_size=1000, n_process=1):
+
+    chunks = iter_desensitized_chunks(filepath, skiprows, chunksize, detector,
+                                      batch_size, n_process)
+    df = pd.concat(chunks, ignore_index=True)
 
     return(df)
 
 
+def write_desensitized_csv(filepath_in, filepath_out, skiprows,
+                           chunksize=10000, detector=None, batch_size=1000,
+                           n_process=1):
+    """Remove the sensitive comments from an excel file and write the
+    remaining rows to a csv one chunk at a time, so only one chunk is held in
+    memory"""
+
+    with open(filepath_out, 'w', newline='') as f:
+        chunks = iter_desensitized_chunks(filepath_in, skiprows, chunksize,
+                                          detector, batch_size, n_process)
+        for i, df in enumerate(chunks):
+            df.to_csv(f, header=(i == 0), index=False)
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = remove_sensitive_text(args.input_xlsx, args.skiprows)
-    df.to_csv(args.output_csv, index=False)
+    store = PreprocessingCache(args.verdicts) if args.verdicts else None
+    detector = SensitiveTextDetector(batch_size=args.batch_size,
+                                     n_process=args.n_process,
+                                     prefilter=args.prefilter, store=store)
+    write_desensitized_csv(args.input_xlsx, args.output_csv, args.skiprows,
+                           args.chunksize, detector)
+    if store is not None:
+        store.close()
+    print('{} of {} comments had a stored verdict, {} more skipped named '
+          'entity recognition'.format(detector.n_stored, detector.n_comments,
+                                      detector.n_skipped))
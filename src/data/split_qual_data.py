@@ -1,54 +1,205 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: May 2019
 # This script file is for splitting the comment datasets into a train and test
-# to ensure dataset test data is untouched during our analysis
+# to ensure dataset test data is untouched during our analysis.
+# The rows are assigned to k folds with iterative stratification so every
+# theme has about the same share of comments in each fold. Fold 0 is the test
+# set and the other folds can be used for cross validation. Only the fold of
+# each row is saved, the later stages read their rows from the single
+# desensitized data file. Copies of the test and train rows, which some of the
+# notebooks read, are only written if --output_csv1 and --output_csv2 are
+# given. export_split_csv.py writes them from an existing split index.
 
 # USAGE:
 '''
 python src/data/split_qual_data.py \
 --input_csv data/interim/desensitized_qualitative-data2018.csv \
+--output_index data/interim/split_index_2018.npz \
+--output_arrow data/interim/desensitized_qualitative-data2018.arrow \
+--n_folds 10
+'''
+
+# USAGE to also write copies of the test and train data:
+'''
+python src/data/split_qual_data.py \
+--input_csv data/interim/desensitized_qualitative-data2018.csv \
+--output_index data/interim/split_index_2018.npz \
 --output_csv1 data/interim/test_2018-qualitative-data.csv \
 --output_csv2 data/interim/train_2018-qualitative-data.csv
 '''
 
+import sys
+sys.path.insert(1, '.')
+import numpy as np
 import pandas as pd
 import argparse
+from src.data.qual_dataset import write_dataset, write_split_index
+from src.data.qual_dataset import split_mask
 
 # Default File paths:
 filepath_in = "data/interim/desensitized_qualitative-data2018.csv"
-filepath_out_test = "data/interim/test_2018-qualitative-data.csv"
-filepath_out_train = "data/interim/train_2018-qualitative-data.csv"
+filepath_out_index = "data/interim/split_index_2018.npz"
 
 
 def get_arguments():
-    parser = argparse.ArgumentParser(description='Remove sensitive comments'
-                                     'from excel WES survey and write to csv')
+    parser = argparse.ArgumentParser(description='Split the desensitized '
+                                     'comments into stratified folds')
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store', default=filepath_in,
                         help='the input csv file')
 
+    parser.add_argument('--output_index', '-x', type=str,
+                        dest='output_index', action='store',
+                        default=filepath_out_index,
+                        help='the output split index npz file')
+
+    parser.add_argument('--n_folds', '-k', type=int, dest='n_folds',
+                        action='store', default=10,
+                        help='the number of folds, fold 0 is the test set')
+
+    parser.add_argument('--seed', type=int, dest='seed',
+                        action='store', default=2019,
+                        help='the random seed used to break ties')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=100000,
+                        help='the number of csv rows to read at a time')
+
+    parser.add_argument('--output_arrow', type=str, dest='output_arrow',
+                        action='store', default=None,
+                        help='the output arrow file with all the rows, not '
+                        'written if not given')
+
     parser.add_argument('--output_csv1', '-o', type=str, dest='output_csv1',
-                        action='store', default=filepath_out_test,
-                        help='the test output csv file')
+                        action='store', default=None,
+                        help='the test output csv file, not written if not '
+                        'given')
 
     parser.add_argument('--output_csv2', '-o2', type=str, dest='output_csv2',
-                        action='store', default=filepath_out_train,
-                        help='the train output csv file')
+                        action='store', default=None,
+                        help='the train output csv file, not written if not '
+                        'given')
 
     args = parser.parse_args()
     return args
 
 
+def read_label_matrix(filepath, chunksize=100000):
+    '''Reads only the theme columns CPD to OTH of a csv, one chunk at a time
+
+    Returns
+    -------
+    Y : uint8 numpy array with a row for each comment
+    '''
+    columns = pd.read_csv(filepath, nrows=0).columns
+    columns = list(columns[columns.get_loc('CPD'):columns.get_loc('OTH') + 1])
+
+    chunks = [np.array(chunk[columns], dtype=np.uint8) for chunk in
+              pd.read_csv(filepath, usecols=columns, chunksize=chunksize)]
+
+    if not chunks:
+        return np.zeros((0, len(columns)), dtype=np.uint8)
+    return np.concatenate(chunks)
+
+
+def iterative_stratification(Y, n_folds=10, random_state=None):
+    '''Assigns rows with several labels to folds so each fold has about the
+    same share of the rows with each label (Sechidis et al. 2011).
+
+    The label with the fewest unassigned rows is handled first. Each of its
+    rows goes to the fold that most needs that label, then the fold that
+    most needs rows, with remaining ties broken at random. Rows without a
+    label go to the folds that most need rows.
+
+    Parameters
+    ----------
+    Y : numpy array, binary label matrix with a row for each comment
+    n_folds : int, number of folds of equal size
+    random_state : int or numpy RandomState
+
+    Returns
+    -------
+    folds : int8 numpy array with the fold of each row
+    '''
+    if isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    Y = np.asarray(Y, dtype=bool)
+    n_rows, n_labels = Y.shape
+
+    folds = np.full(n_rows, -1, dtype=np.int8)
+    desired = np.full(n_folds, n_rows / n_folds)
+    desired_label = np.outer(Y.sum(axis=0), np.full(n_folds, 1 / n_folds))
+    remaining = Y.sum(axis=0)
+    unassigned = np.ones(n_rows, dtype=bool)
+
+    def choose_from(candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        return candidates[rng.randint(len(candidates))]
+
+    def argmax_tie(values):
+        return choose_from(np.flatnonzero(values == values.max()))
+
+    while remaining.any():
+        label = argmax_tie(-np.where(remaining > 0, remaining, np.inf))
+
+        rows = np.flatnonzero(Y[:, label] & unassigned)
+        for row in rows[rng.permutation(len(rows))]:
+            need = desired_label[label]
+            candidates = np.flatnonzero(need == need.max())
+            if len(candidates) > 1:
+                need_rows = desired[candidates]
+                candidates = candidates[need_rows == need_rows.max()]
+            fold = choose_from(candidates)
+
+            folds[row] = fold
+            desired[fold] -= 1
+            desired_label[Y[row], fold] -= 1
+        remaining -= Y[rows].sum(axis=0)
+        unassigned[rows] = False
+
+    for row in np.flatnonzero(unassigned):
+        fold = argmax_tie(desired)
+        folds[row] = fold
+        desired[fold] -= 1
+
+    return folds
+
+
+def write_subset_csv(filepath_in, filepath_out, mask, chunksize=100000):
+    '''Copies the rows of a csv selected by a mask, one chunk at a time'''
+    n_rows = 0
+    for i, chunk in enumerate(pd.read_csv(filepath_in, chunksize=chunksize)):
+        selected = chunk[mask[n_rows:n_rows + len(chunk)]]
+        selected.to_csv(filepath_out, mode='w' if i == 0 else 'a',
+                        header=(i == 0), index=False)
+        n_rows += len(chunk)
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
 
-    df_raw_2018 = pd.read_csv(args.input_csv)
+    Y = read_label_matrix(args.input_csv, args.chunksize)
+    folds = iterative_stratification(Y, args.n_folds, args.seed)
+    write_split_index(args.output_index, folds, args.n_folds, test_fold=0,
+                      seed=args.seed)
 
-    df_test_2018 = df_raw_2018.sample(frac=0.1, random_state=2019)
-    df_train_2018 = df_raw_2018.drop(index=df_test_2018.index)
+    # Columnar copy of all the rows that later stages can memory map
+    if args.output_arrow:
+        write_dataset(pd.read_csv(args.input_csv, chunksize=args.chunksize),
+                      args.output_arrow)
 
-    df_test_2018.to_csv(path_or_buf=args.output_csv1, index=False)
-    df_train_2018.to_csv(path_or_buf=args.output_csv2, index=False)
+    if args.output_csv1:
+        write_subset_csv(args.input_csv, args.output_csv1,
+                         split_mask(args.output_index, 'test'),
+                         args.chunksize)
+    if args.output_csv2:
+        write_subset_csv(args.input_csv, args.output_csv2,
+                         split_mask(args.output_index, 'train'),
+                         args.chunksize)
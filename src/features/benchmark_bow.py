@@ -0,0 +1,109 @@
+# benchmark_bow.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script compares the bag of words vectorizer with hashing vectorizers
+# of several sizes. For each it reports the time and peak memory to build the
+# train and test matrices, the size of the pickled vectorizer and the macro
+# F1 score of the LinearSVC baseline on the test data.
+
+# USAGE:
+'''
+python src/features/benchmark_bow.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--hashing_features 262144 1048576 4194304
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import pickle
+import argparse
+import tracemalloc
+from sklearn.metrics import f1_score
+from src.data.qual_dataset import read_comments, read_labels
+from src.features.bow_vectorizer import get_bow_vectorizer
+from src.features.bow_vectorizer import get_hashing_vectorizer
+from src.features.vectorize_comments import get_vectorized_comments
+from src.models.linearsvc import train_linearsvc, train_linearsvc_sparse
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the bow and '
+                                     'hashing vectorizers')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store',
+                        default='data/interim/'
+                        'desensitized_qualitative-data2018.arrow',
+                        help='the input csv or arrow file with comments and '
+                        'labels')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store',
+                        default='data/interim/split_index_2018.npz',
+                        help='the split index file with the test fold')
+
+    parser.add_argument('--hashing_features', '-n', type=int,
+                        dest='hashing_features', action='store', nargs='+',
+                        default=[2 ** 18, 2 ** 20, 2 ** 22],
+                        help='the numbers of hashing buckets to compare')
+
+    args = parser.parse_args()
+    return args
+
+
+def run_vectorizer(make_vectorizer, comments_train, comments_test):
+    '''Builds a vectorizer and both matrices, and returns them with the time
+    and peak traced memory it took'''
+
+    tracemalloc.start()
+    start = time.time()
+
+    vectorizer = make_vectorizer()
+    X_train = get_vectorized_comments(comments_train, vectorizer)
+    X_test = get_vectorized_comments(comments_test, vectorizer)
+
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return vectorizer, X_train, X_test, elapsed, peak
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    comments_train = read_comments(args.input_csv, args.split_index, 'train')
+    comments_test = read_comments(args.input_csv, args.split_index, 'test')
+    Y_train = read_labels(args.input_csv, args.split_index, 'train')
+    Y_test = read_labels(args.input_csv, args.split_index, 'test')
+    print('Benchmarking', len(comments_train), 'train and', len(comments_test),
+          'test comments')
+
+    backends = [('bow', lambda: get_bow_vectorizer(comments_train))]
+    for n_features in args.hashing_features:
+        backends.append(('hashing %d' % n_features,
+                         lambda n=n_features: get_hashing_vectorizer(n)))
+
+    print('{:<16} {:>9} {:>11} {:>12} {:>9}'.format(
+        'vectorizer', 'time (s)', 'peak (MB)', 'pickle (KB)', 'macro F1'))
+
+    for name, make_vectorizer in backends:
+        vectorizer, X_train, X_test, elapsed, peak = run_vectorizer(
+            make_vectorizer, comments_train, comments_test)
+        size = len(pickle.dumps(vectorizer, protocol=pickle.HIGHEST_PROTOCOL))
+
+        # The hashed matrices are too wide to be made dense
+        if name == 'bow':
+            model = train_linearsvc(X_train, Y_train)
+        else:
+            model = train_linearsvc_sparse(X_train, Y_train)
+        Y_pred = model.predict(X_test).toarray()
+        f1 = f1_score(Y_test, Y_pred, average='macro')
+
+        print('{:<16} {:9.2f} {:11.1f} {:12.1f} {:9.4f}'.format(
+            name, elapsed, peak / 2 ** 20, size / 2 ** 10, f1))
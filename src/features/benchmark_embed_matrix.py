@@ -0,0 +1,147 @@
+# benchmark_embed_matrix.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script times building the embedding matrix of each tokenizer with the
+# original one word at a time loop and with the batched build_embed_matrix,
+# and checks they give the same matrix. It then times the OOV strategies and
+# reports how many of the tokenizer's words, and of their occurrences in the
+# comments, get a vector.
+
+# USAGE:
+'''
+python src/features/benchmark_embed_matrix.py \
+--input_pk models/embed_tokenizers.pickle \
+--input_embed_glove_crawl references/pretrained_embeddings.nosync/glove/glove.840B.300d.store \
+--input_embed_glove_wiki references/pretrained_embeddings.nosync/glove/glove.6B.300d.store \
+--input_embed_fasttext_crawl references/pretrained_embeddings.nosync/fasttext/crawl-300d-2M.store
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import pickle
+import argparse
+import numpy as np
+from src.features.embedding_store import load_embedding
+from src.features.keras_embeddings import build_embed_matrix
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark building the '
+                                     'embedding matrices')
+
+    parser.add_argument('--input_pk', '-i', type=str, dest='input_pk',
+                        action='store',
+                        default='models/embed_tokenizers.pickle',
+                        help='the embed tokenizers pickle')
+
+    parser.add_argument('--input_embed_glove_crawl', type=str,
+                        dest='input_embed_glove_crawl', action='store',
+                        default='references/pretrained_embeddings.nosync/'
+                        'glove/glove.840B.300d.store',
+                        help='the glove crawl embed file or store')
+
+    parser.add_argument('--input_embed_glove_wiki', type=str,
+                        dest='input_embed_glove_wiki', action='store',
+                        default='references/pretrained_embeddings.nosync/'
+                        'glove/glove.6B.300d.store',
+                        help='the glove wiki embed file or store')
+
+    parser.add_argument('--input_embed_fasttext_crawl', type=str,
+                        dest='input_embed_fasttext_crawl', action='store',
+                        default='references/pretrained_embeddings.nosync/'
+                        'fasttext/crawl-300d-2M.store',
+                        help='the fasttext crawl embed file or store')
+
+    parser.add_argument('--embed_size', type=int, dest='embed_size',
+                        action='store', default=300,
+                        help='the size of the vectors')
+
+    args = parser.parse_args()
+    return args
+
+
+def loop_embed_matrix(embed_index, word_index, embed_size=300,
+                      max_words=12000):
+    '''The original matrix, each word is looked up on its own'''
+
+    num_words = min(max_words, len(word_index) + 1)
+    embedding_matrix = np.zeros((num_words, embed_size), dtype='float32')
+
+    for word, i in word_index.items():
+        if i >= max_words:
+            continue
+        try:
+            embedding_vector = embed_index[word]
+            if embedding_vector is not None:
+                embedding_matrix[i] = embedding_vector
+        except KeyError:
+            continue
+
+    return embedding_matrix
+
+
+def coverage(embedding_matrix, tokenizer):
+    '''Returns the fraction of the words in the matrix with a vector and the
+    fraction of their occurrences in the comments'''
+    counts = np.zeros(len(embedding_matrix))
+    for word, i in tokenizer.word_index.items():
+        if i < len(embedding_matrix):
+            counts[i] = tokenizer.word_counts.get(word, 0)
+
+    covered = embedding_matrix[1:].any(axis=1)
+    return covered.mean(), counts[1:][covered].sum() / counts[1:].sum()
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    with open(args.input_pk, 'rb') as handle:
+        embed_tokenizers = pickle.load(handle)
+
+    embedding_fnames = {
+        'glove_crawl': args.input_embed_glove_crawl,
+        'glove_wiki': args.input_embed_glove_wiki,
+        'fasttext_crawl': args.input_embed_fasttext_crawl}
+
+    runs = [[], ['case'], ['case', 'subword'], ['case', 'subword', 'random']]
+
+    print('{:<15} {:<25} {:>9} {:>7} {:>7} {:>7} {:>7} {:>8} {:>8}'.format(
+        'embedding', 'build', 'time (s)', 'found', 'case', 'subword',
+        'random', 'words %', 'tokens %'))
+
+    for embed, filepath in embedding_fnames.items():
+        tokenizer = embed_tokenizers[embed]
+        start = time.time()
+        embed_index = load_embedding(filepath, unicode_errors='ignore',
+                                     binary=False)
+        print('{:<15} {:<25} {:9.2f}'.format(embed, 'load',
+                                             time.time() - start))
+
+        start = time.time()
+        expected = loop_embed_matrix(embed_index, tokenizer.word_index,
+                                     args.embed_size)
+        print('{:<15} {:<25} {:9.2f}'.format(embed, 'loop',
+                                             time.time() - start))
+
+        for oov in runs:
+            start = time.time()
+            embedding_matrix, stats = build_embed_matrix(
+                embed_index, tokenizer.word_index, args.embed_size, oov=oov)
+            elapsed = time.time() - start
+
+            if not oov:
+                assert np.array_equal(embedding_matrix, expected), \
+                    'Embedding matrices differ for ' + embed
+
+            words, tokens = coverage(embedding_matrix, tokenizer)
+            print('{:<15} {:<25} {:9.2f} {:7d} {:>7} {:>7} {:>7} {:8.2f} '
+                  '{:8.2f}'.format(embed, 'batch ' + '+'.join(oov), elapsed,
+                                   stats['found'],
+                                   *[str(stats.get(name, '-')) for name
+                                     in ['case', 'subword', 'random']],
+                                   words * 100, tokens * 100))
@@ -0,0 +1,118 @@
+# benchmark_vocabulary.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script compares loading the pickled bow vectorizer with loading its
+# compact vocabulary. Each is loaded in a fresh process, which reports the
+# load time and its resident memory before and after. Both then transform
+# the same comments, the matrices must be equal.
+
+# USAGE:
+'''
+python src/features/benchmark_vocabulary.py \
+--input_pk models/bow_vectorizer.pickle \
+--input_dir models/bow_vocabulary \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import json
+import time
+import argparse
+import subprocess
+from src.data.preprocessing_text import preprocess_for_bow
+from src.data.qual_dataset import read_comments
+from src.features.compact_vocabulary import load_bow_vectorizer
+
+# Run in a fresh process, prints the load time and resident memory in bytes
+load_script = '''
+import sys, json, time, resource
+sys.path.insert(1, '.')
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+# Both need scikit-learn for the analyzer, import it before measuring
+import sklearn.feature_extraction.text
+from src.features.compact_vocabulary import load_bow_vectorizer
+before = rss()
+start = time.time()
+vectorizer = load_bow_vectorizer(sys.argv[1])
+elapsed = time.time() - start
+print(json.dumps({'time': elapsed, 'before': before, 'after': rss(),
+                  'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark loading the bow '
+                                     'vectorizer pickle and compact '
+                                     'vocabulary')
+
+    parser.add_argument('--input_pk', '-i', type=str, dest='input_pk',
+                        action='store',
+                        default='models/bow_vectorizer.pickle',
+                        help='the bow vectorizer pickle')
+
+    parser.add_argument('--input_dir', '-d', type=str, dest='input_dir',
+                        action='store', default='models/bow_vocabulary',
+                        help='the directory of the compact vocabulary')
+
+    parser.add_argument('--input_csv', '-i2', type=str, dest='input_csv',
+                        action='store',
+                        default='data/interim/'
+                        'desensitized_qualitative-data2018.arrow',
+                        help='the csv or arrow file with the comments to '
+                        'transform')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store',
+                        default='data/interim/split_index_2018.npz',
+                        help='the split index file, the test rows are '
+                        'transformed')
+
+    args = parser.parse_args()
+    return args
+
+
+def measure_load(filepath):
+    '''Loads a vectorizer in a new process and returns what it reports'''
+    output = subprocess.run([sys.executable, '-c', load_script, filepath],
+                            check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode())
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    comments = preprocess_for_bow(read_comments(args.input_csv,
+                                                args.split_index, 'test'))
+
+    print('{:<10} {:>13} {:>12} {:>15} {:>13}'.format(
+        'vectorizer', 'load (ms)', 'RSS (MB)', 'peak RSS (MB)',
+        'transform (s)'))
+
+    matrices = []
+    for name, filepath in [('pickle', args.input_pk),
+                           ('compact', args.input_dir)]:
+        load = measure_load(filepath)
+
+        vectorizer = load_bow_vectorizer(filepath)
+        start = time.time()
+        matrices.append(vectorizer.transform(comments))
+        elapsed = time.time() - start
+
+        print('{:<10} {:13.1f} {:12.1f} {:15.1f} {:13.2f}'.format(
+            name, load['time'] * 1000,
+            (load['after'] - load['before']) / 2 ** 20,
+            load['peak'] / 2 ** 10, elapsed))
+
+    X_pickle, X_compact = matrices
+    assert X_pickle.shape == X_compact.shape, 'Matrix shapes differ'
+    assert (X_pickle != X_compact).nnz == 0, 'Matrices differ'
+    assert X_pickle.dtype == X_compact.dtype, 'Matrix types differ'
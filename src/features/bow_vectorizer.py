@@ -2,29 +2,43 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-11
 
-# This script file builds the bow vectorizer to be used later in the model
+# This script file builds the bow vectorizer to be used later in the model.
+# With --hashing_features the vectorizer hashes the n-grams into a fixed
+# number of columns instead of learning a vocabulary, so it needs no fit and
+# the pickle holds only its parameters.
 
 # USAGE:
 '''
 python src/features/bow_vectorizer.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
 --output_pk models/bow_vectorizer.pickle
 '''
 
+# USAGE for the hashing vectorizer:
+'''
+python src/features/bow_vectorizer.py \
+--output_pk models/bow_vectorizer.pickle \
+--hashing_features 1048576
+'''
+
 
 # Import Modules
 import sys
 sys.path.insert(1, '.')
-import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 from src.data.preprocessing_text import preprocess_for_bow
-import scipy
+from src.data.preprocessing_cache import PreprocessingCache
+from src.data.qual_dataset import read_comments
 import argparse
 import pickle
 
 
 # Default file paths
-filepath_in = "data/interim/train_2018-qualitative-data.csv"
+filepath_in = "data/interim/desensitized_qualitative-data2018.arrow"
+filepath_index = "data/interim/split_index_2018.npz"
 filepath_out = "models/bow_vectorizer.pickle"
 
 
@@ -34,21 +48,55 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store', default=filepath_in,
-                        help='the input csv file with comments')
+                        help='the input csv or arrow file with comments')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=filepath_index,
+                        help='the split index file, only the rows of the '
+                        "subset are read from the input file. Pass '' to "
+                        'read every row of the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--output_pk', '-o', type=str, dest='output_pk',
                         action='store', default=filepath_out,
                         help='the test output csv file')
 
+    parser.add_argument('--cache', '-c', type=str, dest='cache',
+                        action='store', default=None,
+                        help='the preprocessing cache file, not used if '
+                        'not given')
+
+    parser.add_argument('--hashing_features', '-n', type=int,
+                        dest='hashing_features', action='store',
+                        default=None,
+                        help='the number of hashing buckets, if given a '
+                        'hashing vectorizer is saved and no comments are read')
+
     args = parser.parse_args()
     return args
 
 
-def get_bow_vectorizer(comments):
+def get_hashing_vectorizer(n_features=2 ** 20):
+    '''Returns a stateless vectorizer that counts the same n-grams as the
+    bow vectorizer in n_features hashed columns. Unlike the bow vectorizer
+    it keeps n-grams that appear in only one comment.'''
+
+    vectorizer = HashingVectorizer(stop_words='english', ngram_range=(1, 5),
+                                   n_features=n_features,
+                                   alternate_sign=False, norm=None)
+
+    return vectorizer
+
+
+def get_bow_vectorizer(comments, cache=None):
 
     vectorizer = CountVectorizer(stop_words='english', ngram_range=(1, 5),
                                  min_df=2)
-    comments = preprocess_for_bow(comments)
+    comments = preprocess_for_bow(comments, cache)
 
     vectorizer.fit(comments)
 
@@ -59,10 +107,16 @@ def get_bow_vectorizer(comments):
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
 
-    bow_vectorizer = get_bow_vectorizer(comments)
+    if args.hashing_features:
+        bow_vectorizer = get_hashing_vectorizer(args.hashing_features)
+    else:
+        comments = read_comments(args.input_csv, args.split_index,
+                                 args.subset)
+        cache = PreprocessingCache(args.cache) if args.cache else None
+        bow_vectorizer = get_bow_vectorizer(comments, cache)
+        if cache is not None:
+            cache.close()
 
     with open(args.output_pk, 'wb') as handle:
         pickle.dump(bow_vectorizer, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,276 @@
+# compact_vocabulary.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script defines a compact on-disk form of the fitted bow vectorizer and
+# a vectorizer that transforms comments with it. The n-grams are stored as
+# one block of utf-8 bytes in column order with their offsets, and a sorted
+# array of 64-bit keys maps an n-gram to its column. The arrays are memory
+# mapped when loaded, so no Python dictionary of n-grams is ever built.
+
+# USAGE:
+'''
+python src/features/compact_vocabulary.py \
+--input_pk models/bow_vectorizer.pickle \
+--output_dir models/bow_vocabulary
+'''
+
+# Import modules
+import os
+import zlib
+import pickle
+import argparse
+import numpy as np
+import scipy.sparse
+
+# Default file paths
+filepath_in = "models/bow_vectorizer.pickle"
+dirpath_out = "models/bow_vocabulary"
+
+# Bump when the layout of the files changes
+vocabulary_version = 1
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Save the vocabulary of a '
+                                     'bow vectorizer in compact form')
+
+    parser.add_argument('--input_pk', '-i', type=str, dest='input_pk',
+                        action='store', default=filepath_in,
+                        help='the input bow vectorizer pickle')
+
+    parser.add_argument('--output_dir', '-o', type=str, dest='output_dir',
+                        action='store', default=dirpath_out,
+                        help='the output directory of the compact vocabulary')
+
+    args = parser.parse_args()
+    return args
+
+
+def _term_key(term):
+    '''64-bit key of an utf-8 encoded term. Equal keys do not mean equal
+    terms, every match is checked against the stored bytes.'''
+    return zlib.crc32(term) | (zlib.adler32(term) << 32)
+
+
+def write_term_index(terms, dirpath):
+    '''Saves utf-8 encoded terms so TermIndex can map a term to its position
+
+    The directory gets the term bytes and offsets in position order and the
+    sorted keys with their positions. Terms whose keys collide are left out
+    of the keys and returned, they are looked up in a small dictionary.
+
+    Parameters
+    ----------
+    terms : list of bytes, the term at each position
+    dirpath : str, output directory, created if missing
+
+    Returns
+    -------
+    collisions : dict with the position of each term whose key collides,
+        the first position of a repeated term
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    n_terms = len(terms)
+
+    offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in terms], out=offsets[1:])
+    blob = np.frombuffer(b''.join(terms), dtype=np.uint8)
+
+    keys = np.fromiter((_term_key(term) for term in terms), dtype=np.uint64,
+                       count=n_terms)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    columns = order.astype(np.int64)
+
+    duplicate = np.zeros(n_terms, dtype=bool)
+    duplicate[1:] = keys[1:] == keys[:-1]
+    duplicate[:-1] |= duplicate[1:].copy()
+    collisions = {}
+    for column in columns[duplicate]:
+        # A repeated term keeps its first position
+        collisions.setdefault(terms[column], int(column))
+
+    np.save(os.path.join(dirpath, 'terms.npy'), blob)
+    np.save(os.path.join(dirpath, 'offsets.npy'), offsets)
+    np.save(os.path.join(dirpath, 'keys.npy'), keys[~duplicate])
+    np.save(os.path.join(dirpath, 'columns.npy'), columns[~duplicate])
+
+    return collisions
+
+
+class TermIndex:
+    '''Memory maps the arrays of write_term_index and looks up terms
+
+    Parameters
+    ----------
+    dirpath : str, directory written by write_term_index
+    collisions : dict returned by write_term_index
+    '''
+    def __init__(self, dirpath, collisions):
+        self.collisions = collisions
+        self._collision_keys = {_term_key(term) for term in collisions}
+
+        def load(name):
+            return np.load(os.path.join(dirpath, name + '.npy'),
+                           mmap_mode='r')
+
+        self.terms = load('terms')
+        self.offsets = load('offsets')
+        self.keys = load('keys')
+        self.columns = load('columns')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term(self, position):
+        '''Returns the utf-8 encoded term at a position'''
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.terms[start:end].tobytes()
+
+    def lookup(self, terms):
+        '''Returns the position of each utf-8 encoded term, or -1 if the term
+        is not in the index'''
+        result = np.full(len(terms), -1, dtype=np.int64)
+        if not terms:
+            return result
+
+        term_keys = np.fromiter((_term_key(term) for term in terms),
+                                dtype=np.uint64, count=len(terms))
+        position = np.searchsorted(self.keys, term_keys)
+        position[position == len(self.keys)] = 0
+        if len(self.keys):
+            hits = np.flatnonzero(self.keys[position] == term_keys)
+        else:
+            hits = position[:0]
+
+        for hit, column in zip(hits, self.columns[position[hits]]):
+            if self.term(column) == terms[hit]:
+                result[hit] = column
+
+        if self._collision_keys:
+            for i, key in enumerate(term_keys.tolist()):
+                if key in self._collision_keys:
+                    result[i] = self.collisions.get(terms[i], -1)
+
+        return result
+
+    def all_terms(self):
+        '''Returns the decoded terms in position order'''
+        terms = self.terms.tobytes()
+        return [terms[start:end].decode('utf-8') for start, end
+                in zip(self.offsets[:-1], self.offsets[1:])]
+
+
+def write_vocabulary(vectorizer, dirpath):
+    '''Saves a fitted CountVectorizer as a compact vocabulary
+
+    The directory holds the term index of the n-grams in column order and a
+    pickle of the vectorizer settings without its vocabulary.
+
+    Parameters
+    ----------
+    vectorizer : fitted sklearn CountVectorizer
+    dirpath : str, output directory, created if missing
+    '''
+    n_features = len(vectorizer.vocabulary_)
+    terms = [None] * n_features
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term.encode('utf-8')
+
+    collisions = write_term_index(terms, dirpath)
+
+    # The settings are the vectorizer itself with the large fitted attributes
+    # removed, so the analyzer is rebuilt exactly as it was fitted
+    settings = pickle.loads(pickle.dumps(vectorizer))
+    for attribute in ['vocabulary_', 'stop_words_']:
+        if hasattr(settings, attribute):
+            delattr(settings, attribute)
+
+    with open(os.path.join(dirpath, 'settings.pickle'), 'wb') as handle:
+        pickle.dump({'version': vocabulary_version, 'vectorizer': settings,
+                     'n_features': n_features, 'collisions': collisions},
+                    handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class CompactCountVectorizer:
+    '''Transforms comments like the CountVectorizer it was saved from, using
+    the memory mapped arrays of write_vocabulary instead of a dictionary.
+
+    Parameters
+    ----------
+    dirpath : str, directory written by write_vocabulary
+    '''
+    def __init__(self, dirpath):
+        self._load(dirpath)
+
+    def _load(self, dirpath):
+        self.dirpath = dirpath
+
+        with open(os.path.join(dirpath, 'settings.pickle'), 'rb') as handle:
+            settings = pickle.load(handle)
+        if settings['version'] != vocabulary_version:
+            raise ValueError('%s has vocabulary version %r, expected %r'
+                             % (dirpath, settings['version'],
+                                vocabulary_version))
+
+        self.vectorizer = settings['vectorizer']
+        self.n_features = settings['n_features']
+        self.index = TermIndex(dirpath, settings['collisions'])
+        self._analyzer = self.vectorizer.build_analyzer()
+
+    # Worker processes get the directory and map the files themselves
+    def __getstate__(self):
+        return {'dirpath': self.dirpath}
+
+    def __setstate__(self, state):
+        self._load(state['dirpath'])
+
+    def transform(self, raw_documents):
+        '''Returns the document-term matrix of the comments, the same as the
+        transform of the original CountVectorizer'''
+        grams = []
+        indptr = [0]
+        for document in raw_documents:
+            grams.extend(gram.encode('utf-8')
+                         for gram in self._analyzer(document))
+            indptr.append(len(grams))
+
+        columns = self.index.lookup(grams)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        found = columns >= 0
+
+        X = scipy.sparse.csr_matrix(
+            (np.ones(found.sum(), dtype=self.vectorizer.dtype),
+             (rows[found], columns[found])),
+            shape=(len(indptr) - 1, self.n_features))
+        X.sum_duplicates()
+        if self.vectorizer.binary:
+            X.data.fill(1)
+
+        return X
+
+    def get_feature_names_out(self):
+        '''Returns the n-grams in column order'''
+        return np.array(self.index.all_terms(), dtype=object)
+
+
+def load_bow_vectorizer(filepath):
+    '''Loads a bow vectorizer from a pickle, or a compact vocabulary if
+    filepath is a directory'''
+    if os.path.isdir(filepath):
+        return CompactCountVectorizer(filepath)
+
+    with open(filepath, 'rb') as handle:
+        return pickle.load(handle)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    with open(args.input_pk, 'rb') as handle:
+        bow_vectorizer = pickle.load(handle)
+
+    write_vocabulary(bow_vectorizer, args.output_dir)
@@ -0,0 +1,213 @@
+# embedding_store.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script converts a pretrained embedding in the word2vec text format to
+# a directory that loads in a moment: the vectors as a float32 npy matrix and
+# a term index that maps each word to its row. The matrix is memory mapped,
+# so only the rows that are looked up are read from disk. The conversion
+# parses the text file once, the later stages load the directory instead.
+
+# USAGE:
+'''
+python src/features/embedding_store.py \
+--input_embed references/pretrained_embeddings.nosync/glove/glove.840B.300d.w2v.txt \
+--output_dir references/pretrained_embeddings.nosync/glove/glove.840B.300d.store
+'''
+
+# Import modules
+import sys
+sys.path.insert(1, '.')
+import os
+import pickle
+import argparse
+import itertools
+import numpy as np
+from src.features.compact_vocabulary import write_term_index, TermIndex
+
+# Bump when the layout of the files changes
+store_version = 1
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Convert a pretrained '
+                                     'embedding to a memory mapped store')
+
+    parser.add_argument('--input_embed', '-i', type=str, dest='input_embed',
+                        action='store',
+                        help='the input embedding in the word2vec text '
+                        'format, with or without the header line')
+
+    parser.add_argument('--output_dir', '-o', type=str, dest='output_dir',
+                        action='store',
+                        help='the output directory of the embedding store')
+
+    parser.add_argument('--unicode_errors', type=str, dest='unicode_errors',
+                        action='store', default='ignore',
+                        help='how words that are not valid utf-8 are decoded')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='the number of lines to parse at a time')
+
+    args = parser.parse_args()
+    return args
+
+
+def _read_header(filepath):
+    '''Returns the number of vectors, their size and whether the first line
+    is a header. Without a header the lines are counted.'''
+    with open(filepath, 'rb') as handle:
+        first = handle.readline().split()
+        if len(first) == 2 and all(part.isdigit() for part in first):
+            return int(first[0]), int(first[1]), True
+
+        n_words = 1 + sum(1 for line in handle if line.strip())
+        return n_words, len(first) - 1, False
+
+
+def convert_embedding(filepath, dirpath, unicode_errors='ignore',
+                      chunksize=10000):
+    '''Writes an embedding in the word2vec text format as an embedding store
+
+    Each line is a word followed by its vector. The vector is the last
+    vector_size fields, so words that contain spaces are kept. A word that
+    appears twice keeps its first vector, like gensim.
+
+    Parameters
+    ----------
+    filepath : str, path of the .txt or .vec embedding
+    dirpath : str, output directory, created if missing
+    unicode_errors : str, how words that are not valid utf-8 are decoded
+    chunksize : int, number of lines to parse at a time
+    '''
+    n_words, vector_size, has_header = _read_header(filepath)
+    os.makedirs(dirpath, exist_ok=True)
+
+    vectors = np.lib.format.open_memmap(os.path.join(dirpath, 'vectors.npy'),
+                                        mode='w+', dtype=np.float32,
+                                        shape=(n_words, vector_size))
+    words = []
+
+    with open(filepath, 'rb') as handle:
+        if has_header:
+            handle.readline()
+        lines = (line for line in handle if line.strip())
+
+        while True:
+            chunk = list(itertools.islice(lines, chunksize))
+            if not chunk:
+                break
+            if len(words) + len(chunk) > n_words:
+                raise ValueError('%s has more vectors than its header says'
+                                 % filepath)
+
+            values = []
+            for line in chunk:
+                parts = line.rstrip().rsplit(b' ', vector_size)
+                if len(parts) != vector_size + 1:
+                    raise ValueError('invalid vector on line %d of %s'
+                                     % (len(words) + has_header + 1,
+                                        filepath))
+                # Normalize the word like gensim so it is found the same way
+                word = parts[0].decode('utf-8', errors=unicode_errors)
+                words.append(word.encode('utf-8'))
+                values.append(b' '.join(parts[1:]))
+
+            block = np.fromstring(b' '.join(values).decode('ascii'),
+                                  dtype=np.float32, sep=' ')
+            if len(block) != len(chunk) * vector_size:
+                raise ValueError('invalid number in the vectors before line '
+                                 '%d of %s' % (len(words) + has_header,
+                                               filepath))
+            start = len(words) - len(chunk)
+            vectors[start:len(words)] = block.reshape(-1, vector_size)
+
+    if len(words) != n_words:
+        raise ValueError('%s has %d vectors but its header says %d'
+                         % (filepath, len(words), n_words))
+    vectors.flush()
+    del vectors
+
+    collisions = write_term_index(words, dirpath)
+
+    with open(os.path.join(dirpath, 'settings.pickle'), 'wb') as handle:
+        pickle.dump({'version': store_version, 'vector_size': vector_size,
+                     'collisions': collisions,
+                     'source': os.path.basename(filepath)},
+                    handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class EmbeddingStore:
+    '''Word vectors of a directory written by convert_embedding. Words are
+    looked up like a dictionary or gensim KeyedVectors, and lookup gives the
+    rows of many words at once.
+
+    Parameters
+    ----------
+    dirpath : str, directory written by convert_embedding
+    '''
+    def __init__(self, dirpath):
+        self._load(dirpath)
+
+    def _load(self, dirpath):
+        self.dirpath = dirpath
+
+        with open(os.path.join(dirpath, 'settings.pickle'), 'rb') as handle:
+            settings = pickle.load(handle)
+        if settings['version'] != store_version:
+            raise ValueError('%s has embedding store version %r, expected %r'
+                             % (dirpath, settings['version'], store_version))
+
+        self.vector_size = settings['vector_size']
+        self.index = TermIndex(dirpath, settings['collisions'])
+        self.vectors = np.load(os.path.join(dirpath, 'vectors.npy'),
+                               mmap_mode='r')
+
+    # Worker processes get the directory and map the files themselves
+    def __getstate__(self):
+        return {'dirpath': self.dirpath}
+
+    def __setstate__(self, state):
+        self._load(state['dirpath'])
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def lookup(self, words):
+        '''Returns the row of each word in vectors, or -1 if the word is not
+        in the embedding'''
+        return self.index.lookup([word.encode('utf-8') for word in words])
+
+    def __contains__(self, word):
+        return self.lookup([word])[0] >= 0
+
+    def __getitem__(self, word):
+        row = self.lookup([word])[0]
+        if row < 0:
+            raise KeyError(word)
+        return np.array(self.vectors[row])
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+
+def load_embedding(filepath, **kwargs):
+    '''Loads an embedding store if filepath is a directory, otherwise parses
+    the text file with gensim, passing on kwargs'''
+    if os.path.isdir(filepath):
+        return EmbeddingStore(filepath)
+
+    from gensim.models import KeyedVectors
+    return KeyedVectors.load_word2vec_format(filepath, **kwargs)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    convert_embedding(args.input_embed, args.output_dir, args.unicode_errors,
+                      args.chunksize)
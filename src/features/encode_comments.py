@@ -4,22 +4,30 @@
 
 # This script encodes the comments for the Keras Model to train and predict
 # Default inputs are set to encode the 2018 train comments
+# Embeddings that are preprocessed the same way and share a tokenizer share
+# one encoded array, which the pickle stores once
+# With --output_dir the comments are saved without padding as memory mapped
+# token ids, see encoded_sequences.py
 
 # For MakeFile do both usages
 # USAGE for train data:
 '''
 python src/features/encode_comments.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
 --input_pk models/embed_tokenizers.pickle \
---output_pk data/processed/X_train_encoded.pickle
+--output_dir data/processed/X_train_encoded
 '''
 
 # USAGE for test data
 '''
 python src/features/encode_comments.py \
---input_csv data/interim/test_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset test \
 --input_pk models/embed_tokenizers.pickle \
---output_pk data/processed/X_test_encoded.pickle
+--output_dir data/processed/X_test_encoded
 '''
 
 
@@ -28,10 +36,11 @@ import sys
 sys.path.insert(1, '.')
 import argparse
 import pickle
-import pandas as pd
-import numpy as np
 from keras.preprocessing.sequence import pad_sequences
-from src.data.preprocessing_text import preprocess_for_embed
+from src.data.preprocessing_text import preprocess_batch, group_profiles
+from src.data.preprocessing_cache import PreprocessingCache
+from src.data.qual_dataset import read_comments
+from src.features.encoded_sequences import write_encoded
 
 
 def get_arguments():
@@ -40,7 +49,17 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store',
-                        help='the input csv file with comments')
+                        help='the input csv or arrow file with comments')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=None,
+                        help='the split index file, if given only the rows '
+                        'of the subset are read from the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--input_pk', '-i2', type=str, dest='input_pk',
                         action='store',
@@ -50,37 +69,104 @@ def get_arguments():
                         dest='output_pk', action='store',
                         help='the output encoded comments')
 
+    parser.add_argument('--output_dir', '-d', type=str,
+                        dest='output_dir', action='store', default=None,
+                        help='the output directory of the encoded comments '
+                        'without padding, used instead of output_pk')
+
+    parser.add_argument('--n_workers', '-w', type=int, dest='n_workers',
+                        action='store', default=1,
+                        help='the number of processes for preprocessing')
+
+    parser.add_argument('--cache', '-c', type=str, dest='cache',
+                        action='store', default=None,
+                        help='the preprocessing cache file, not used if '
+                        'not given')
+
     args = parser.parse_args()
     return args
 
 
-def get_encoded_comments(comments, tokenizer, embed_name):
+def get_encoded_sequences(comments, tokenizer, embed_name, n_workers=1,
+                          cache=None):
+    '''Returns the token ids of each comment without padding'''
+
+    comments = preprocess_batch(comments, embed_name, split=False,
+                                n_workers=n_workers, cache=cache)
+    return tokenizer.texts_to_sequences(comments)
+
 
-    comments = np.array(preprocess_for_embed(comments, embed_name, False))
-    X = tokenizer.texts_to_sequences(comments)
+def get_encoded_comments(comments, tokenizer, embed_name, n_workers=1,
+                         cache=None):
+
+    X = get_encoded_sequences(comments, tokenizer, embed_name, n_workers,
+                              cache)
     X = pad_sequences(X, maxlen=700)
 
     return X
 
 
+def get_encoded_profiles(comments, embed_tokenizers, n_workers=1, cache=None,
+                         pad=True):
+    '''Encodes the comments for each embedding. The comments are encoded once
+    for each group of embeddings with the same preprocessing and tokenizer,
+    and the embeddings of a group share the array.
+
+    Parameters
+    ----------
+    comments : Pandas series object
+    embed_tokenizers : dict with the fitted tokenizer of each embedding
+    pad : bool, if False the token id lists are returned without padding,
+        see write_encoded
+
+    Returns
+    -------
+    encoded_comments : dict with the encoded comments of each embedding
+    '''
+    encode = get_encoded_comments if pad else get_encoded_sequences
+
+    encoded = {}
+    for embed, members in group_profiles(list(embed_tokenizers)).items():
+        shared = {}
+        for member in members:
+            tokenizer = embed_tokenizers[member]
+            if id(tokenizer) not in shared:
+                shared[id(tokenizer)] = encode(comments, tokenizer, member,
+                                               n_workers, cache)
+            encoded[member] = shared[id(tokenizer)]
+
+    return {embed: encoded[embed] for embed in embed_tokenizers}
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
     embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
+    comments = read_comments(args.input_csv, args.split_index,
+                             args.subset)
+    cache = PreprocessingCache(args.cache) if args.cache else None
 
     # Load Tokenizers
     with open(args.input_pk, 'rb') as handle:
         embed_tokenizers = pickle.load(handle)
 
     # Encode Comments and save processed data for model training
-    encoded_comments = {}
-    for embed in embed_names:
-        encoded_comments[embed] = get_encoded_comments(comments,
-                                                       embed_tokenizers[embed],
-                                                       embed)
-
-    with open(args.output_pk, 'wb') as handle:
-        pickle.dump(encoded_comments, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    embed_tokenizers = {embed: embed_tokenizers[embed]
+                        for embed in embed_names}
+
+    if args.output_dir:
+        # Ragged token ids that are padded when the batches are made
+        encoded_comments = get_encoded_profiles(comments, embed_tokenizers,
+                                                args.n_workers, cache,
+                                                pad=False)
+        write_encoded(args.output_dir, encoded_comments)
+    else:
+        encoded_comments = get_encoded_profiles(comments, embed_tokenizers,
+                                                args.n_workers, cache)
+        with open(args.output_pk, 'wb') as handle:
+            pickle.dump(encoded_comments, handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,163 @@
+# encoded_sequences.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script defines the ragged storage of the encoded comments. The token
+# ids of all the comments are saved one after the other in a single npy file
+# with a second file of offsets where each comment starts, so no space is
+# spent on padding. The files are memory mapped when read and batches of
+# comments are padded when they are used, to the length of their longest
+# comment or to a bucket length.
+
+# Import modules
+import os
+import json
+import pickle
+import itertools
+import numpy as np
+
+# Bump when the layout of the files changes
+encoded_version = 1
+
+
+def write_encoded(dirpath, encoded_comments):
+    '''Saves the token ids of the comments for each embedding. Embeddings that
+    share the same list of sequences share the files.
+
+    Parameters
+    ----------
+    dirpath : str, output directory, created if missing
+    encoded_comments : dict with a list of token id lists for each embedding
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+
+    stems = {}
+    shared = {}
+    for embed, sequences in encoded_comments.items():
+        if id(sequences) in shared:
+            stems[embed] = shared[id(sequences)]
+            continue
+
+        lengths = np.fromiter((len(sequence) for sequence in sequences),
+                              dtype=np.int64, count=len(sequences))
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        tokens = np.fromiter(itertools.chain.from_iterable(sequences),
+                             dtype=np.int64, count=offsets[-1])
+        dtype = np.uint16 if not len(tokens) or tokens.max() < 2 ** 16 \
+            else np.int32
+
+        np.save(os.path.join(dirpath, embed + '.tokens.npy'),
+                tokens.astype(dtype))
+        np.save(os.path.join(dirpath, embed + '.offsets.npy'), offsets)
+        stems[embed] = shared[id(sequences)] = embed
+
+    with open(os.path.join(dirpath, 'embeddings.json'), 'w') as handle:
+        json.dump({'version': encoded_version, 'embeddings': stems}, handle)
+
+
+class EncodedSequences:
+    '''Memory mapped token ids of the comments written by write_encoded
+
+    Parameters
+    ----------
+    tokens : numpy array, the token ids of all the comments
+    offsets : numpy array, where each comment starts in tokens and the end
+        of the last comment
+    '''
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def pad(self, indices=None, maxlen=700, buckets=None):
+        '''Returns comments padded like keras pad_sequences, with zeros before
+        the tokens and only the last maxlen tokens of longer comments
+
+        Parameters
+        ----------
+        indices : array of the comments to pad, all of them if None
+        maxlen : int, the most tokens kept of a comment
+        buckets : sorted list of lengths, if given the batch is padded to the
+            smallest one that fits its longest comment instead of to that
+            comment's length
+
+        Returns
+        -------
+        X : int32 numpy array with a row for each comment
+        '''
+        if indices is None:
+            indices = np.arange(len(self))
+        indices = np.asarray(indices, dtype=np.int64)
+
+        ends = np.asarray(self.offsets[indices + 1])
+        lengths = np.minimum(ends - self.offsets[indices], maxlen)
+        width = int(lengths.max()) if len(lengths) else 0
+        if buckets is not None:
+            fits = [bucket for bucket in buckets if bucket >= width]
+            width = min(fits[0] if fits else maxlen, maxlen)
+
+        total = int(lengths.sum())
+        rows = np.repeat(np.arange(len(indices)), lengths)
+        within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths,
+                                              lengths)
+        source = np.repeat(ends - lengths, lengths) + within
+
+        X = np.zeros((len(indices), width), dtype=np.int32)
+        X[rows, width - lengths[rows] + within] = self.tokens[source]
+
+        return X
+
+
+def read_encoded(dirpath):
+    '''Memory maps the encoded comments of each embedding in a directory
+    written by write_encoded. Embeddings that share files share the object.
+
+    Returns
+    -------
+    encoded_comments : dict with the EncodedSequences of each embedding
+    '''
+    with open(os.path.join(dirpath, 'embeddings.json')) as handle:
+        index = json.load(handle)
+    if index['version'] != encoded_version:
+        raise ValueError('%s has encoded version %r, expected %r'
+                         % (dirpath, index['version'], encoded_version))
+
+    shared = {}
+    for stem in set(index['embeddings'].values()):
+        shared[stem] = EncodedSequences(
+            np.load(os.path.join(dirpath, stem + '.tokens.npy'),
+                    mmap_mode='r'),
+            np.load(os.path.join(dirpath, stem + '.offsets.npy'),
+                    mmap_mode='r'))
+
+    return {embed: shared[stem] for embed, stem
+            in index['embeddings'].items()}
+
+
+def load_encoded_comments(filepath, maxlen=700):
+    '''Returns the encoded comments of each embedding padded to maxlen, from
+    a directory written by write_encoded or a pickle of padded arrays'''
+    if not os.path.isdir(filepath):
+        with open(filepath, 'rb') as handle:
+            return pickle.load(handle)
+
+    encoded = read_encoded(filepath)
+    padded = {}
+    for embed, sequences in encoded.items():
+        if id(sequences) not in padded:
+            padded[id(sequences)] = sequences.pad(maxlen=maxlen,
+                                                  buckets=[maxlen])
+
+    return {embed: padded[id(sequences)] for embed, sequences
+            in encoded.items()}
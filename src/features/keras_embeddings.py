@@ -7,14 +7,20 @@
 # dictionary of arrays with an item for each embedding. These are saved in the
 # models folder. To run this script you need to have the required pretrained
 # embeddings in the reference folder. See Readme for more details
+# Each embedding can be the text file or the directory it was converted to by
+# embedding_store.py, which loads much faster. The matrices only need the
+# vectors of the tokenizers' words, so each embedding file is scanned once in
+# its own process and only those vectors are kept.
 
 # USAGE:
 '''
 python src/features/keras_embeddings.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
---input_embed_glove_crawl references/pretrained_embeddings.nosync/glove/glove.840B.300d.w2v.txt \
---input_embed_glove_wiki references/pretrained_embeddings.nosync/glove/glove.6B.300d.w2v.txt \
---input_embed_fasttext_crawl references/pretrained_embeddings.nosync/fasttext/crawl-300d-2M.vec \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
+--input_embed_glove_crawl references/pretrained_embeddings.nosync/glove/glove.840B.300d.store \
+--input_embed_glove_wiki references/pretrained_embeddings.nosync/glove/glove.6B.300d.store \
+--input_embed_fasttext_crawl references/pretrained_embeddings.nosync/fasttext/crawl-300d-2M.store \
 --output_pk1 models/embed_tokenizers.pickle \
 --output_pk2 models/embed_matrices.pickle
 '''
@@ -22,13 +28,17 @@ python src/features/keras_embeddings.py \
 # Import Modules
 import sys
 sys.path.insert(1, '.')
+import os
 import pickle
 import argparse
-import pandas as pd
 import numpy as np
-from src.data.preprocessing_text import preprocess_for_embed
+from concurrent.futures import ProcessPoolExecutor
+from src.data.preprocessing_text import preprocess_batch, iter_batch
+from src.data.preprocessing_text import group_profiles
+from src.data.preprocessing_cache import PreprocessingCache
+from src.data.qual_dataset import read_comments
+from src.features.embedding_store import load_embedding
 from keras.preprocessing.text import Tokenizer
-from gensim.models import KeyedVectors
 
 
 def get_arguments():
@@ -37,22 +47,32 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store',
-                        help='the input csv file with comments')
+                        help='the input csv or arrow file with comments')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=None,
+                        help='the split index file, if given only the rows '
+                        'of the subset are read from the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--input_embed_glove_crawl', type=str,
                         dest='input_embed_glove_crawl',
                         action='store',
-                        help='the input glove crawl embed')
+                        help='the input glove crawl embed file or store')
 
     parser.add_argument('--input_embed_glove_wiki', type=str,
                         dest='input_embed_glove_wiki',
                         action='store',
-                        help='the input glove wiki embed')
+                        help='the input glove wiki embed file or store')
 
     parser.add_argument('--input_embed_fasttext_crawl', type=str,
                         dest='input_embed_fasttext_crawl',
                         action='store',
-                        help='the input glove fasttext embed')
+                        help='the input glove fasttext embed file or store')
 
     parser.add_argument('--output_pk1', '-o1', type=str,
                         dest='output_pk1', action='store',
@@ -62,41 +82,332 @@ def get_arguments():
                         dest='output_pk2', action='store',
                         help='the output embed matrix')
 
+    parser.add_argument('--n_workers', '-w', type=int, dest='n_workers',
+                        action='store', default=1,
+                        help='the number of processes for preprocessing')
+
+    parser.add_argument('--cache', '-c', type=str, dest='cache',
+                        action='store', default=None,
+                        help='the preprocessing cache file, not used if '
+                        'not given')
+
+    parser.add_argument('--oov', type=str, dest='oov', action='store',
+                        nargs='*', default=[],
+                        choices=['case', 'subword', 'random'],
+                        help='the strategies for words not in an embedding, '
+                        'in the order they are tried. Without any the rows '
+                        'are left as zeros')
+
     args = parser.parse_args()
     return args
 
 
-def get_embed_tokenizer(comments, embed_name, max_words=12000):
+def get_embed_tokenizer(comments, embed_name, max_words=12000, n_workers=1,
+                        cache=None):
 
-    comments = np.array(preprocess_for_embed(comments, embed_name, False))
+    if n_workers == 1 and cache is None:
+        # Stream the comments so they are not all held in memory at once
+        comments = iter_batch(comments, embed_name, split=False)
+    else:
+        comments = preprocess_batch(comments, embed_name, split=False,
+                                    n_workers=n_workers, cache=cache)
     tokenizer = Tokenizer(num_words=max_words)
     tokenizer.fit_on_texts(comments)
 
     return tokenizer
 
 
-def get_embed_matrix(embed_index, tokenizer, embed_size=300, max_words=12000):
-
-    word_index = tokenizer.word_index
+def _embedding_rows(embed_index, words, embed_size):
+    '''Returns the row of each word in a matrix of vectors, -1 for words not
+    in the embedding, and the matrix
+
+    Parameters
+    ----------
+    embed_index : EmbeddingStore, gensim KeyedVectors or dict of vectors
+    words : list of str
+    embed_size : int, the width of the matrix when no word is found in a
+        dict of vectors
+    '''
+    if hasattr(embed_index, 'lookup'):
+        return embed_index.lookup(words), embed_index.vectors
+
+    # gensim 4 and gensim 3 keyed vectors
+    if hasattr(embed_index, 'key_to_index'):
+        get = embed_index.key_to_index.get
+        return (np.fromiter((get(word, -1) for word in words),
+                            dtype=np.int64, count=len(words)),
+                embed_index.vectors)
+    if hasattr(embed_index, 'vocab'):
+        vocab = embed_index.vocab
+        return (np.fromiter((vocab[word].index if word in vocab else -1
+                             for word in words),
+                            dtype=np.int64, count=len(words)),
+                embed_index.vectors)
+
+    # A dictionary, the vectors found are stacked into a matrix
+    vectors = [embed_index.get(word) for word in words]
+    found = [vector for vector in vectors if vector is not None]
+    rows = np.full(len(words), -1, dtype=np.int64)
+    rows[[vector is not None for vector in vectors]] = np.arange(len(found))
+    if not found:
+        return rows, np.zeros((0, embed_size), dtype='float32')
+    return rows, np.array(found, dtype='float32')
+
+
+def _gather(embed_index, words, embed_size):
+    '''Returns the vectors of the words in one gather, zeros for words not in
+    the embedding, and a mask of the words found'''
+    rows, vectors = _embedding_rows(embed_index, words, embed_size)
+    found = np.flatnonzero(rows >= 0)
+
+    # Reading the rows in order keeps a memory mapped matrix sequential
+    order = np.argsort(rows[found], kind='stable')
+    result = np.zeros((len(words), vectors.shape[1]), dtype='float32')
+    result[found[order]] = vectors[rows[found[order]]]
+
+    return result, rows >= 0
+
+
+def oov_case(words, embed_index, known, rng):
+    '''Retries each word in lowercase, titlecase and uppercase, in order'''
+    variants = [[variant for variant in (word.lower(), word.title(),
+                                         word.upper()) if variant != word]
+                for word in words]
+    candidates = [variant for word_variants in variants
+                  for variant in word_variants]
+    vectors, found = _gather(embed_index, candidates, known.shape[1])
+
+    result = np.zeros((len(words), known.shape[1]), dtype='float32')
+    resolved = np.zeros(len(words), dtype=bool)
+    start = 0
+    for i, word_variants in enumerate(variants):
+        for j in range(start, start + len(word_variants)):
+            if found[j]:
+                result[i] = vectors[j]
+                resolved[i] = True
+                break
+        start += len(word_variants)
+
+    return result, resolved
+
+
+def oov_subword(words, embed_index, known, rng, min_n=3):
+    '''Averages the vectors of the pieces of each word that are in the
+    embedding. The word is split from left to right into the longest pieces
+    of at least min_n characters found in the embedding, characters that
+    start no such piece are skipped.'''
+    pieces = {word[start:end] for word in words
+              for start in range(len(word))
+              for end in range(start + min_n, len(word) + 1)
+              if end - start < len(word)}
+    pieces = sorted(pieces)
+    vectors, found = _gather(embed_index, pieces, known.shape[1])
+    piece_vectors = {piece: vectors[i] for i, piece
+                     in enumerate(pieces) if found[i]}
+
+    result = np.zeros((len(words), known.shape[1]), dtype='float32')
+    resolved = np.zeros(len(words), dtype=bool)
+    for i, word in enumerate(words):
+        segments = []
+        start = 0
+        while start < len(word):
+            for end in range(len(word), start + min_n - 1, -1):
+                if word[start:end] in piece_vectors:
+                    segments.append(piece_vectors[word[start:end]])
+                    start = end
+                    break
+            else:
+                start += 1
+        if segments:
+            result[i] = np.mean(segments, axis=0)
+            resolved[i] = True
+
+    return result, resolved
+
+
+def oov_random(words, embed_index, known, rng):
+    '''Draws a random vector for each word from a normal distribution with
+    the mean and standard deviation of the vectors found'''
+    if len(known):
+        mean, std = known.mean(), known.std()
+    else:
+        mean, std = 0, 1
+    result = rng.normal(mean, std, (len(words), known.shape[1]))
+
+    return result.astype('float32'), np.ones(len(words), dtype=bool)
+
+
+# Strategies for words not in the embedding, in the order they are tried.
+# A strategy takes the words, the embedding, the vectors found so far and a
+# numpy RandomState and returns the vectors and a mask of the words resolved.
+oov_strategies = {'case': oov_case, 'subword': oov_subword,
+                  'random': oov_random}
+
+
+def build_embed_matrix(embed_index, word_index, embed_size=300,
+                       max_words=12000, oov=(), random_state=2019):
+    '''Builds the embedding matrix of a tokenizer. The words are looked up in
+    one batch and their vectors gathered at once, then the words not found
+    are passed to each OOV strategy in turn.
+
+    Parameters
+    ----------
+    embed_index : EmbeddingStore, gensim KeyedVectors or dict of vectors
+    word_index : dict, the word_index of the fitted tokenizer
+    embed_size : int, size of the vectors
+    max_words : int, number of rows of the matrix at most
+    oov : list of names in oov_strategies or functions with the same
+        arguments, applied in order to the words still not found
+    random_state : int, seed of the random numbers used by the strategies
+
+    Returns
+    -------
+    embedding_matrix : float32 numpy array with the vector of the word with
+        index i in row i, zeros for words that are not resolved
+    stats : dict with the number of words, the number found in the
+        embedding, the number resolved by each strategy and the number left
+        as zeros
+    '''
     num_words = min(max_words, len(word_index) + 1)
     embedding_matrix = np.zeros((num_words, embed_size), dtype='float32')
 
-    for word, i in word_index.items():
+    words = [word for word, i in word_index.items() if i < max_words]
+    index = np.array([word_index[word] for word in words], dtype=np.int64)
 
-        if i >= max_words:
-            continue
+    vectors, found = _gather(embed_index, words, embed_size)
+    embedding_matrix[index[found]] = vectors[found]
+    stats = {'words': len(words), 'found': int(found.sum())}
 
-        try:
-            embedding_vector = embed_index[word]
+    known = embedding_matrix[index[found]]
+    missing = np.flatnonzero(~found)
+    rng = np.random.RandomState(random_state)
+    for strategy in oov:
+        name = strategy if isinstance(strategy, str) else strategy.__name__
+        strategy = oov_strategies.get(strategy, strategy)
 
-            if embedding_vector is not None:
-                embedding_matrix[i] = embedding_vector
-        except:
-            continue
+        vectors, resolved = strategy([words[i] for i in missing],
+                                     embed_index, known, rng)
+        embedding_matrix[index[missing[resolved]]] = vectors[resolved]
+        stats[name] = int(resolved.sum())
+        missing = missing[~resolved]
 
+    stats['missing'] = len(missing)
+
+    return embedding_matrix, stats
+
+
+def get_embed_matrix(embed_index, tokenizer, embed_size=300, max_words=12000,
+                     oov=(), random_state=2019):
+    '''Returns the embedding matrix of a tokenizer, see build_embed_matrix'''
+    embedding_matrix, _ = build_embed_matrix(embed_index,
+                                             tokenizer.word_index,
+                                             embed_size, max_words, oov,
+                                             random_state)
     return embedding_matrix
 
 
+def _scan_vectors(filepath, words, embed_size=300, unicode_errors='ignore'):
+    '''Scans an embedding text file once and returns a dictionary with the
+    vectors of the words found. Only their vectors are parsed and the scan
+    stops when all the words have been found.'''
+    needed = set(words)
+    vectors = {}
+
+    with open(filepath, 'rb') as handle:
+        for line in handle:
+            word, _, vector = line.partition(b' ')
+            word = word.decode('utf-8', errors=unicode_errors)
+            if word not in needed:
+                continue
+
+            # The header line and words with spaces have a different number
+            # of fields, the tokenizer's words never contain spaces
+            vector = np.fromstring(vector.decode('ascii'), dtype='float32',
+                                   sep=' ')
+            if len(vector) != embed_size:
+                continue
+
+            # A repeated word keeps its first vector, like gensim
+            needed.remove(word)
+            vectors[word] = vector
+            if not needed:
+                break
+
+    return vectors
+
+
+def extract_embed_matrix(filepath, word_index, embed_size=300,
+                         max_words=12000, oov=(), random_state=2019,
+                         unicode_errors='ignore'):
+    '''Builds the embedding matrix without loading the whole embedding. A
+    text file is scanned once for the words in the matrix, an embedding
+    store is memory mapped.
+
+    Parameters
+    ----------
+    filepath : str, path of the embedding in the word2vec text format, or
+        the directory of an embedding store
+    word_index : dict, the word_index of the fitted tokenizer
+    oov : list of OOV strategies, see build_embed_matrix. The subword
+        strategy needs the whole vocabulary and so an embedding store.
+    unicode_errors : str, how words that are not valid utf-8 are decoded
+
+    Returns
+    -------
+    embedding_matrix : float32 numpy array
+    stats : dict with the coverage of the words, see build_embed_matrix
+    '''
+    if os.path.isdir(filepath):
+        embed_index = load_embedding(filepath)
+    else:
+        if 'subword' in oov:
+            raise ValueError('the subword strategy needs an embedding store, '
+                             'convert %s with embedding_store.py' % filepath)
+        words = [word for word, i in word_index.items() if i < max_words]
+        if 'case' in oov:
+            words += [variant for word in words for variant
+                      in (word.lower(), word.title(), word.upper())]
+        embed_index = _scan_vectors(filepath, words, embed_size,
+                                    unicode_errors)
+
+    return build_embed_matrix(embed_index, word_index, embed_size, max_words,
+                              oov, random_state)
+
+
+def _extract_job(job):
+    return extract_embed_matrix(*job)
+
+
+def extract_embed_matrices(embedding_fnames, embed_tokenizers,
+                           embed_size=300, max_words=12000, oov=()):
+    '''Extracts the embedding matrix of each embedding in its own process
+
+    Parameters
+    ----------
+    embedding_fnames : dict with the file path of each embedding
+    embed_tokenizers : dict with the fitted tokenizer of each embedding
+    oov : list of OOV strategies, see build_embed_matrix
+
+    Returns
+    -------
+    embed_matrices : dict with the embedding matrix of each embedding
+    embed_stats : dict with the coverage of each embedding
+    '''
+    embed_names = list(embedding_fnames)
+    jobs = [(embedding_fnames[embed], embed_tokenizers[embed].word_index,
+             embed_size, max_words, tuple(oov)) for embed in embed_names]
+
+    with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+        results = list(executor.map(_extract_job, jobs))
+
+    embed_matrices = {embed: matrix for embed, (matrix, _)
+                      in zip(embed_names, results)}
+    embed_stats = {embed: stats for embed, (_, stats)
+                   in zip(embed_names, results)}
+
+    return embed_matrices, embed_stats
+
+
 ###############################################################################
 if __name__ == "__main__":
 
@@ -110,33 +421,35 @@ if __name__ == "__main__":
 
     embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
+    comments = read_comments(args.input_csv, args.split_index,
+                             args.subset)
+    cache = PreprocessingCache(args.cache) if args.cache else None
 
     # Get and save tokenizers for each embedding
     # Preprocessing the comments is different depending on the embedding, which
-    # is why there are different tokenizers
+    # is why there are different tokenizers. Embeddings with the same
+    # preprocessing share one tokenizer, which the pickle stores once
     embed_tokenizers = {}
-    for embed in embed_names:
-        embed_tokenizers[embed] = get_embed_tokenizer(comments, embed)
+    for embed, members in group_profiles(embed_names).items():
+        tokenizer = get_embed_tokenizer(comments, embed,
+                                        n_workers=args.n_workers, cache=cache)
+        for member in members:
+            embed_tokenizers[member] = tokenizer
+    embed_tokenizers = {embed: embed_tokenizers[embed]
+                        for embed in embed_names}
+    if cache is not None:
+        cache.close()
 
     with open(args.output_pk1, 'wb') as handle:
         pickle.dump(embed_tokenizers, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-    # Load pretrained embeddings
-    embed_indices = {}
-    for embed in embedding_fnames.keys():
-        print('Loading pretrained embedding for', embed)
-        embed_indices[embed] = KeyedVectors.load_word2vec_format(
-                                    embedding_fnames[embed],
-                                    unicode_errors='ignore',
-                                    binary=False)
-
-    # Get and save the embedding matrix for each embedding
-    embed_matrices = {}
-    for embed in embedding_fnames.keys():
-        embed_matrices[embed] = get_embed_matrix(embed_indices[embed],
-                                                 embed_tokenizers[embed])
+    # Get and save the embedding matrix for each embedding, the embeddings
+    # are scanned in parallel and only the tokenizers' words are kept
+    print('Extracting pretrained embeddings for', ', '.join(embedding_fnames))
+    embed_matrices, embed_stats = extract_embed_matrices(
+        embedding_fnames, embed_tokenizers, oov=args.oov)
+    for embed, stats in embed_stats.items():
+        print(embed, ', '.join('%s %d' % item for item in stats.items()))
 
     with open(args.output_pk2, 'wb') as handle:
         pickle.dump(embed_matrices, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -2,36 +2,76 @@
 # Author: Fan Nie, Ayla Pearson, Aaron Quinton
 # Date: 2019-06-11
 
-# This script vectorizes comments for later training
+# This script vectorizes comments for later training. The comments are
+# transformed in chunks, optionally in several processes, and the blocks are
+# either stacked into one sparse matrix or streamed to the output npz file so
+# the full matrix is never held in memory.
 
 # For MakeFile do both usages
 # USAGE for train data:
 '''
 python src/features/vectorize_comments.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
 --input_pk models/bow_vectorizer.pickle \
---output_npz data/processed/X_train_bow.npz
+--output_npz data/processed/X_train_bow.npz \
+--n_workers 8 \
+--stream
 '''
 
 # USAGE for test data
 '''
 python src/features/vectorize_comments.py \
---input_csv data/interim/test_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset test \
 --input_pk models/bow_vectorizer.pickle \
 --output_npz data/processed/X_test_bow.npz
 '''
 
+# USAGE with the compact vocabulary of the bow vectorizer, which loads faster
+'''
+python src/features/vectorize_comments.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset test \
+--input_pk models/bow_vocabulary \
+--output_npz data/processed/X_test_bow.npz
+'''
+
+# USAGE with the hashing vectorizer, which needs no input_pk
+'''
+python src/features/vectorize_comments.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset test \
+--hashing_features 1048576 \
+--output_npz data/processed/X_test_bow.npz
+'''
+
 # Import modules
 import sys
 sys.path.insert(1, '.')
-import pandas as pd
 from src.data.preprocessing_text import preprocess_for_bow
-import pickle
+from src.data.preprocessing_cache import PreprocessingCache
+from src.data.qual_dataset import read_comments
+from src.features.bow_vectorizer import get_hashing_vectorizer
+from src.features.compact_vocabulary import load_bow_vectorizer
+import os
 import argparse
+import shutil
+import zipfile
+import tempfile
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import scipy.sparse
 
 # Default File paths:
-filepath_in = './data/interim/train_2018-qualitative-data.csv'
+filepath_in = 'data/interim/desensitized_qualitative-data2018.arrow'
+filepath_index = 'data/interim/split_index_2018.npz'
 filepath_in2 = 'models/bow_vectorizer.pickle'
 filepath_out = './data/processed/X_train_bow.npz'
 
@@ -41,39 +81,277 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store', default=filepath_in,
-                        help='the input csv file with comments')
+                        help='the input csv or arrow file with comments')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=filepath_index,
+                        help='the split index file, only the rows of the '
+                        "subset are read from the input file. Pass '' to "
+                        'read every row of the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--input_pk', '-i2', type=str, dest='input_pk',
                         action='store', default=filepath_in2,
-                        help='the input bow vectorizer')
+                        help='the input bow vectorizer pickle, or the '
+                        'directory of its compact vocabulary')
 
     parser.add_argument('--output_npz', '-o', type=str,
                         dest='output_npz', action='store',
                         default=filepath_out, help='the output npz file')
 
+    parser.add_argument('--cache', '-c', type=str, dest='cache',
+                        action='store', default=None,
+                        help='the preprocessing cache file, not used if '
+                        'not given')
+
+    parser.add_argument('--hashing_features', '-n', type=int,
+                        dest='hashing_features', action='store',
+                        default=None,
+                        help='the number of hashing buckets, if given the '
+                        'comments are hashed and the input bow vectorizer '
+                        'is not read')
+
+    parser.add_argument('--n_workers', '-w', type=int, dest='n_workers',
+                        action='store', default=1,
+                        help='the number of processes used to transform the '
+                        'comments')
+
+    parser.add_argument('--chunksize', type=int, dest='chunksize',
+                        action='store', default=10000,
+                        help='the number of comments transformed at a time')
+
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='write each chunk to the output npz file as it '
+                        'is transformed instead of building the matrix in '
+                        'memory')
+
     args = parser.parse_args()
     return args
 
 
-def get_vectorized_comments(comments, vectorizer):
+# Vectorizer of the worker processes, set once when a worker starts or
+# inherited from the parent when processes are forked
+_worker_vectorizer = None
+
+
+def _init_worker(vectorizer):
+    global _worker_vectorizer
+    _worker_vectorizer = vectorizer
+
+
+def _transform_chunk(comments):
+    return _worker_vectorizer.transform(comments)
+
+
+def iter_transformed(comments, vectorizer, n_workers=1, chunksize=10000):
+    '''Yields the sparse matrix of each chunk of preprocessed comments, in
+    order. With several workers the vectorizer is sent to each process once
+    and at most two chunks per worker are in flight at a time.'''
+    chunks = (comments[start:start + chunksize]
+              for start in range(0, len(comments), chunksize))
+
+    if n_workers == 1:
+        for chunk in chunks:
+            yield vectorizer.transform(chunk)
+        return
+
+    # Forked workers share the parent's copy of the vocabulary
+    if multiprocessing.get_start_method() == 'fork':
+        _init_worker(vectorizer)
+        pool_args = {}
+    else:
+        pool_args = {'initializer': _init_worker, 'initargs': (vectorizer,)}
 
-    comments = preprocess_for_bow(comments)
-    X = vectorizer.transform(comments)
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 **pool_args) as executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_transform_chunk, chunk))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        _init_worker(None)
+
+
+def stack_csr(blocks, n_features):
+    '''Stacks CSR blocks with the same number of columns into one CSR
+    matrix, allocating each output array once'''
+    blocks = [block.tocsr() for block in blocks]
+    n_rows = sum(block.shape[0] for block in blocks)
+    nnz = sum(block.nnz for block in blocks)
+    dtype = blocks[0].dtype if blocks else np.float64
+    index_dtype = np.int32 if max(nnz, n_features) < 2 ** 31 else np.int64
+
+    data = np.empty(nnz, dtype=dtype)
+    indices = np.empty(nnz, dtype=index_dtype)
+    indptr = np.empty(n_rows + 1, dtype=index_dtype)
+    indptr[0] = 0
+
+    row = 0
+    offset = 0
+    for block in blocks:
+        m = block.shape[0]
+        data[offset:offset + block.nnz] = block.data
+        indices[offset:offset + block.nnz] = block.indices
+        indptr[row + 1:row + m + 1] = block.indptr[1:] + offset
+        row += m
+        offset += block.nnz
+
+    return scipy.sparse.csr_matrix((data, indices, indptr),
+                                   shape=(n_rows, n_features))
+
+
+class CsrNpzWriter:
+    '''Writes a CSR matrix to an npz file that scipy.sparse.load_npz reads,
+    one block of rows at a time. The blocks are appended to temporary files
+    and copied into the npz file when it is closed, so memory use does not
+    grow with the number of rows. The npz file is written under a temporary
+    name and renamed when complete, and it is not written at all if the
+    writer is left with an exception.
+
+    Parameters
+    ----------
+    filepath : str, path of the npz file
+    n_features : int, number of columns
+    '''
+    def __init__(self, filepath, n_features):
+        self.filepath = filepath
+        self.n_features = n_features
+        self.n_rows = 0
+        self.nnz = 0
+        self.dtype = None
+        self.index_dtype = np.int32 if n_features < 2 ** 31 else np.int64
+        self._files = {name: tempfile.TemporaryFile()
+                       for name in ['data', 'indices', 'indptr']}
+        self._files['indptr'].write(np.zeros(1, np.int64).tobytes())
+
+    def append(self, block):
+        block = block.tocsr()
+        if self.dtype is None:
+            self.dtype = block.dtype
+
+        self._files['data'].write(
+            np.ascontiguousarray(block.data, dtype=self.dtype).tobytes())
+        self._files['indices'].write(
+            block.indices.astype(self.index_dtype, copy=False).tobytes())
+        self._files['indptr'].write(
+            (block.indptr[1:].astype(np.int64) + self.nnz).tobytes())
+        self.n_rows += block.shape[0]
+        self.nnz += block.nnz
+
+    def _write_array(self, archive, name, source, dtype, length):
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                  'fortran_order': False, 'shape': (length,)}
+        with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            source.seek(0)
+            shutil.copyfileobj(source, f, 2 ** 24)
+
+    def close(self):
+        '''Writes the npz file and removes the temporary files'''
+        dtype = self.dtype if self.dtype is not None else np.float64
+        partial = os.path.join(os.path.dirname(self.filepath) or '.',
+                               '.partial-' + os.path.basename(self.filepath))
+        try:
+            self._write_archive(partial, dtype)
+            os.replace(partial, self.filepath)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        finally:
+            self.discard()
+
+    def discard(self):
+        '''Removes the temporary files without writing the npz file'''
+        for f in self._files.values():
+            f.close()
+
+    def _write_archive(self, filepath, dtype):
+        with zipfile.ZipFile(filepath, 'w',
+                             compression=zipfile.ZIP_DEFLATED) as archive:
+            self._write_array(archive, 'indices', self._files['indices'],
+                              self.index_dtype, self.nnz)
+            self._write_array(archive, 'indptr', self._files['indptr'],
+                              np.int64, self.n_rows + 1)
+            for name, value in [('format', np.array(b'csr')),
+                                ('shape', np.array([self.n_rows,
+                                                    self.n_features]))]:
+                with archive.open(name + '.npy', 'w') as f:
+                    np.lib.format.write_array(f, value)
+            self._write_array(archive, 'data', self._files['data'], dtype,
+                              self.nnz)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _n_features(vectorizer):
+    if hasattr(vectorizer, 'vocabulary_'):
+        return len(vectorizer.vocabulary_)
+    return vectorizer.n_features
+
+
+def get_vectorized_comments(comments, vectorizer, cache=None, n_workers=1,
+                            chunksize=10000):
+    '''Returns the sparse matrix of token counts of the comments. The
+    comments are transformed in chunks, in n_workers processes if more than
+    one, and the chunks are stacked into one matrix.'''
+
+    comments = preprocess_for_bow(comments, cache, n_workers)
+    blocks = iter_transformed(comments, vectorizer, n_workers, chunksize)
+    X = stack_csr(list(blocks), _n_features(vectorizer))
 
     return X
 
 
+def write_vectorized_comments(comments, vectorizer, filepath, cache=None,
+                              n_workers=1, chunksize=10000):
+    '''Writes the sparse matrix of token counts of the comments to an npz
+    file one chunk at a time, without building the matrix in memory'''
+
+    comments = preprocess_for_bow(comments, cache, n_workers)
+    with CsrNpzWriter(filepath, _n_features(vectorizer)) as writer:
+        for block in iter_transformed(comments, vectorizer, n_workers,
+                                      chunksize):
+            writer.append(block)
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
-    df = pd.read_csv(args.input_csv)
-    comments = df.iloc[:, 1]
+    comments = read_comments(args.input_csv, args.split_index,
+                             args.subset)
+    cache = PreprocessingCache(args.cache) if args.cache else None
 
-    # Load Vectorizer
-    with open(args.input_pk, 'rb') as handle:
-        bow_vectorizer = pickle.load(handle)
+    # Load Vectorizer, the hashing vectorizer needs no fitted state
+    if args.hashing_features:
+        bow_vectorizer = get_hashing_vectorizer(args.hashing_features)
+    else:
+        bow_vectorizer = load_bow_vectorizer(args.input_pk)
 
     # Get sparse document-term matrix and save
-    X = get_vectorized_comments(comments, bow_vectorizer)
-    scipy.sparse.save_npz(args.output_npz, X)
+    if args.stream:
+        write_vectorized_comments(comments, bow_vectorizer, args.output_npz,
+                                  cache, args.n_workers, args.chunksize)
+    else:
+        X = get_vectorized_comments(comments, bow_vectorizer, cache,
+                                    args.n_workers, args.chunksize)
+        scipy.sparse.save_npz(args.output_npz, X)
+
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,165 @@
+# benchmark_buckets.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script trains the biGRU or conv1d model on one embedding twice, once
+# on comments padded to 700 and once on bucketed batches, and reports the
+# time and validation loss of every epoch. It also reports how long each run
+# took to reach the best validation loss of the fixed length run. Finally it
+# checks that each model predicts the validation comments with the loss seen
+# in training, and reports the loss when they are all padded to 700.
+
+# USAGE:
+'''
+python src/models/benchmark_buckets.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--input_pk1 models/embed_matrices.pickle \
+--input_pk2 data/processed/X_train_encoded \
+--model biGRU \
+--epochs 3
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import time
+import pickle
+import argparse
+import numpy as np
+from keras.callbacks import Callback
+from src.data.qual_dataset import read_labels
+from src.features.encoded_sequences import read_encoded
+from src.models.biGRU import train_biGRU
+from src.models.conv1d import train_conv1d
+from src.models.bucketed_sequence import predict_model
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark training on '
+                                     'fixed length and bucketed batches')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store',
+                        default='data/interim/'
+                        'desensitized_qualitative-data2018.arrow',
+                        help='the input csv or arrow file with labels')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store',
+                        default='data/interim/split_index_2018.npz',
+                        help='the split index file, the train rows are used')
+
+    parser.add_argument('--input_pk1', '-i2', type=str, dest='input_pk1',
+                        action='store', default='models/embed_matrices.pickle',
+                        help='the input embedding_matrix')
+
+    parser.add_argument('--input_pk2', '-i3', type=str, dest='input_pk2',
+                        action='store',
+                        default='data/processed/X_train_encoded',
+                        help='the encoded comments directory')
+
+    parser.add_argument('--model', '-m', type=str, dest='model',
+                        action='store', default='biGRU',
+                        choices=['biGRU', 'conv1d'],
+                        help='the model to train')
+
+    parser.add_argument('--embed', '-e', type=str, dest='embed',
+                        action='store', default='glove_wiki',
+                        help='the embedding to train on')
+
+    parser.add_argument('--epochs', type=int, dest='epochs',
+                        action='store', default=3,
+                        help='the number of epochs of each run')
+
+    parser.add_argument('--workers', '-w', type=int, dest='workers',
+                        action='store', default=1,
+                        help='the number of workers making bucketed batches')
+
+    args = parser.parse_args()
+    return args
+
+
+class EpochTimer(Callback):
+    '''Records the time and validation loss of every epoch'''
+
+    def on_train_begin(self, logs=None):
+        self.times = []
+        self.val_losses = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.time() - self.start)
+        self.val_losses.append((logs or {}).get('val_loss'))
+
+
+def binary_crossentropy(Y_true, Y_pred):
+    '''The mean binary cross entropy, the loss the models are trained on'''
+    Y_pred = np.clip(Y_pred, 1e-7, 1 - 1e-7)
+    return -np.mean(Y_true * np.log(Y_pred)
+                    + (1 - Y_true) * np.log(1 - Y_pred))
+
+
+def time_to_loss(timer, target):
+    '''Returns the training time until the validation loss first reached the
+    target, or None if it never did'''
+    elapsed = 0
+    for epoch_time, val_loss in zip(timer.times, timer.val_losses):
+        elapsed += epoch_time
+        if val_loss <= target:
+            return elapsed
+    return None
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+    train = {'biGRU': train_biGRU, 'conv1d': train_conv1d}[args.model]
+
+    Y_train = read_labels(args.input_csv, args.split_index, 'train')
+    with open(args.input_pk1, 'rb') as handle:
+        embed_matrix = pickle.load(handle)[args.embed]
+    sequences = read_encoded(args.input_pk2)[args.embed]
+
+    timers = {}
+    models = {}
+    for name, X_train in [('fixed 700', sequences.pad(buckets=[700])),
+                          ('bucketed', sequences)]:
+        timers[name] = EpochTimer()
+        models[name] = train(X_train, Y_train, args.embed, embed_matrix,
+                             epochs=args.epochs, workers=args.workers,
+                             callbacks=[timers[name]])
+
+    target = min(timers['fixed 700'].val_losses)
+    print('{:<10} {:>6} {:>13} {:>9}'.format('batches', 'epoch', 'time (s)',
+                                             'val loss'))
+    for name, timer in timers.items():
+        for epoch, (epoch_time, val_loss) in enumerate(zip(timer.times,
+                                                           timer.val_losses)):
+            print('{:<10} {:6d} {:13.1f} {:9.4f}'.format(name, epoch + 1,
+                                                         epoch_time,
+                                                         val_loss))
+
+    for name, timer in timers.items():
+        reached = time_to_loss(timer, target)
+        print('{:<10} reached val loss {:.4f} {}'.format(
+            name, target, 'in %.1f s' % reached if reached else 'never'))
+
+    # The validation comments are the last 15%, the same as in fit_model
+    validation = np.arange(int(len(sequences) * 0.85), len(sequences))
+    padded = sequences.pad(validation, buckets=[700])
+    print('{:<10} {:>9} {:>9} {:>11}'.format('batches', 'training',
+                                             'predict', 'padded 700'))
+    for name, model in models.items():
+        trained = timers[name].val_losses[-1]
+        predicted = binary_crossentropy(Y_train[validation],
+                                        predict_model(model, padded))
+        fixed = binary_crossentropy(Y_train[validation],
+                                    model.predict(padded, batch_size=128))
+        print('{:<10} {:9.4f} {:9.4f} {:11.4f}'.format(name, trained,
+                                                       predicted, fixed))
+        if not np.isclose(trained, predicted, rtol=1e-3, atol=1e-4):
+            print(name, 'predicts with a different loss than in training')
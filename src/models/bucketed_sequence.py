@@ -0,0 +1,169 @@
+# bucketed_sequence.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script defines a Keras Sequence that trains on the ragged encoded
+# comments. The comments are grouped by length into buckets and each batch
+# only holds comments of one bucket, padded to the bucket length instead of
+# to 700, so the recurrent and convolution layers skip most of the padding.
+# The batches are shuffled across the buckets every epoch. Models trained on
+# buckets take inputs of any length and are padding dependent, so they also
+# predict on comments padded to their bucket length.
+
+# Import modules
+import numpy as np
+from keras.utils import Sequence
+from src.features.encoded_sequences import EncodedSequences
+
+default_buckets = [16, 32, 64, 128, 256, 512, 700]
+
+
+class BucketedSequence(Sequence):
+    '''Batches of comments of similar length with their labels
+
+    Parameters
+    ----------
+    sequences : EncodedSequences of all the comments
+    Y : numpy array with the labels of all the comments
+    indices : array of the comments to use, all of them if None
+    batch_size : int, the most comments in a batch
+    buckets : sorted list of bucket lengths, comments longer than the last
+        one keep only their last tokens
+    shuffle : bool, shuffle the comments in each bucket and the order of the
+        batches every epoch
+    seed : int, seed of the shuffles
+    '''
+    def __init__(self, sequences, Y, indices=None, batch_size=128,
+                 buckets=default_buckets, shuffle=True, seed=None):
+        self.sequences = sequences
+        self.Y = Y
+        self.batch_size = batch_size
+        self.buckets = list(buckets)
+        self.maxlen = self.buckets[-1]
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(seed)
+
+        if indices is None:
+            indices = np.arange(len(sequences))
+        indices = np.asarray(indices, dtype=np.int64)
+
+        lengths = np.minimum(sequences.lengths[indices], self.maxlen)
+        bucket = np.searchsorted(self.buckets, lengths)
+        self.bucket_indices = [indices[bucket == i]
+                               for i in range(len(self.buckets))]
+
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        '''Splits each bucket into batches and shuffles the batches'''
+        batches = []
+        for indices in self.bucket_indices:
+            if self.shuffle:
+                indices = indices[self.rng.permutation(len(indices))]
+            batches.extend(indices[start:start + self.batch_size]
+                           for start in range(0, len(indices),
+                                              self.batch_size))
+
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        self.batches = batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        indices = np.sort(self.batches[i])
+        X = self.sequences.pad(indices, self.maxlen, self.buckets)
+        return X, self.Y[indices]
+
+
+def fit_model(model, X_train, Y_train, batch_size=128, epochs=1,
+              validation_split=0.15, buckets=default_buckets, workers=1,
+              use_multiprocessing=False, callbacks=None, seed=None):
+    '''Trains a model on padded arrays, or on bucketed batches when X_train
+    is EncodedSequences. The validation comments are the last ones in both
+    cases, the same as Keras takes with validation_split.
+
+    Parameters
+    ----------
+    model : compiled Keras model, with inputs of any length for buckets
+    X_train : padded numpy array or EncodedSequences
+    Y_train : numpy array of labels
+    workers : int, processes or threads that make the bucketed batches
+    use_multiprocessing : bool, make the bucketed batches in processes
+
+    Returns
+    -------
+    history : Keras History
+    '''
+    if not isinstance(X_train, EncodedSequences):
+        return model.fit(X_train, Y_train, batch_size=batch_size,
+                         epochs=epochs, validation_split=validation_split,
+                         callbacks=callbacks)
+
+    n_train = int(len(X_train) * (1 - validation_split))
+    train = BucketedSequence(X_train, Y_train, np.arange(n_train),
+                             batch_size, buckets, shuffle=True, seed=seed)
+    validation = BucketedSequence(X_train, Y_train,
+                                  np.arange(n_train, len(X_train)),
+                                  batch_size, buckets, shuffle=False)
+
+    return model.fit_generator(train, epochs=epochs,
+                               validation_data=validation,
+                               workers=workers,
+                               use_multiprocessing=use_multiprocessing,
+                               callbacks=callbacks)
+
+
+def unpad(X):
+    '''Returns comments padded like keras pad_sequences as EncodedSequences.
+    Token id 0 is only used for padding, so each comment starts at its first
+    non zero token.'''
+    X = np.asarray(X)
+    nonzero = X != 0
+    lengths = np.where(nonzero.any(axis=1),
+                       X.shape[1] - nonzero.argmax(axis=1), 0)
+    offsets = np.zeros(len(X) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    tokens = X[np.arange(X.shape[1]) >= X.shape[1] - lengths[:, None]]
+
+    return EncodedSequences(tokens, offsets)
+
+
+def predict_model(model, X, batch_size=128, buckets=default_buckets):
+    '''Returns the predictions of a model on padded arrays or
+    EncodedSequences. A model with a fixed input length predicts on comments
+    padded to that length. A model trained on bucketed batches has no input
+    length, so like in training each comment is padded to its bucket length.
+
+    Parameters
+    ----------
+    model : Keras model
+    X : padded numpy array or EncodedSequences
+    buckets : sorted list of bucket lengths, the ones the model was trained
+        with
+
+    Returns
+    -------
+    Y_pred : numpy array with a row of predictions for each comment
+    '''
+    maxlen = model.input_shape[1]
+    if maxlen is not None:
+        if isinstance(X, EncodedSequences):
+            X = X.pad(maxlen=maxlen, buckets=[maxlen])
+        return model.predict(X, batch_size=batch_size)
+
+    if not isinstance(X, EncodedSequences):
+        X = unpad(X)
+
+    lengths = np.minimum(X.lengths, buckets[-1])
+    bucket = np.searchsorted(buckets, lengths)
+    Y_pred = np.zeros((len(X), model.output_shape[-1]), dtype='float32')
+    for i in range(len(buckets)):
+        indices = np.flatnonzero(bucket == i)
+        if len(indices):
+            Y_pred[indices] = model.predict(X.pad(indices, buckets[-1],
+                                                  buckets),
+                                            batch_size=batch_size)
+
+    return Y_pred
@@ -8,20 +8,26 @@
 # USAGE:
 '''
 python src/models/conv1d.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
 --input_pk1 models/embed_matrices.pickle \
---input_pk2 data/processed/X_train_encoded.pickle \
+--input_pk2 data/processed/X_train_encoded \
 --output_h5 models/conv1d_models.h5
 '''
 
 # Import Modules
+import sys
+sys.path.insert(1, '.')
 import pickle
-import pandas as pd
-import numpy as np
 from keras.layers import Dense, Embedding, Dropout, Activation
 from keras.layers import GlobalMaxPooling1D, Conv1D
 from keras.models import Sequential
 import argparse
+from src.data.qual_dataset import read_labels
+from src.features.encoded_sequences import load_encoded_comments
+from src.features.encoded_sequences import read_encoded, EncodedSequences
+from src.models.bucketed_sequence import fit_model
 
 
 def get_arguments():
@@ -29,7 +35,17 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store',
-                        help='the input csv file with comments and labels')
+                        help='the input csv or arrow file with labels')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=None,
+                        help='the split index file, if given only the rows '
+                        'of the subset are read from the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--input_pk1', '-i2', type=str, dest='input_pk1',
                         action='store',
@@ -37,17 +53,34 @@ def get_arguments():
 
     parser.add_argument('--input_pk2', '-i3', type=str, dest='input_pk2',
                         action='store',
-                        help='input encoded comments')
+                        help='input encoded comments, a pickle or a '
+                        'directory written by encode_comments.py')
 
     parser.add_argument('--output_h5', '-o', type=str,
                         dest='output_h5', action='store',
                         help='the output conv1d model')
 
+    parser.add_argument('--bucket_batches', '-b', dest='bucket_batches',
+                        action='store_true',
+                        help='train on batches of comments of similar length '
+                        'padded to their bucket length, needs the encoded '
+                        'comments directory')
+
+    parser.add_argument('--workers', '-w', type=int, dest='workers',
+                        action='store', default=1,
+                        help='the number of workers making bucketed batches')
+
+    parser.add_argument('--use_multiprocessing', dest='use_multiprocessing',
+                        action='store_true',
+                        help='make the bucketed batches in processes instead '
+                        'of threads')
+
     args = parser.parse_args()
     return args
 
 
-def train_conv1d(X_train, Y_train, embed_name, embed_matrix):
+def train_conv1d(X_train, Y_train, embed_name, embed_matrix, epochs=7,
+                 workers=1, use_multiprocessing=False, callbacks=None):
 
     # Define parameters for Neural Net Architecture
     max_features = embed_matrix.shape[0]
@@ -56,9 +89,12 @@ def train_conv1d(X_train, Y_train, embed_name, embed_matrix):
     filters = 250
     kernel_size = 3
     hidden_dims = 250
-    epochs = 7
     embed_size = 300
 
+    # Bucketed batches have a different length in each batch
+    if isinstance(X_train, EncodedSequences):
+        maxlen = None
+
     # Neural Net Architecture
     model = Sequential()
 
@@ -78,8 +114,10 @@ def train_conv1d(X_train, Y_train, embed_name, embed_matrix):
                   metrics=['accuracy'])
 
     # Train Model
-    model.fit(X_train, Y_train, batch_size=batch_size, epochs=epochs,
-              validation_split=0.15)
+    fit_model(model, X_train, Y_train, batch_size, epochs,
+              validation_split=0.15, workers=workers,
+              use_multiprocessing=use_multiprocessing,
+              callbacks=callbacks)
 
     return model
 
@@ -92,20 +130,22 @@ if __name__ == "__main__":
     embed = 'glove_wiki'
 
     # Get labels
-    df = pd.read_csv(args.input_csv)
-    Y_train = np.array(df.loc[:, "CPD":"OTH"])
+    Y_train = read_labels(args.input_csv, args.split_index, args.subset)
 
     # Load embedding matrices
     with open(args.input_pk1, 'rb') as handle:
         embed_matrices = pickle.load(handle)
 
-    # Load training data
-    with open(args.input_pk2, 'rb') as handle:
-        X_train_encoded = pickle.load(handle)
+    # Load training data, ragged for bucketed batches
+    if args.bucket_batches:
+        X_train_encoded = read_encoded(args.input_pk2)
+    else:
+        X_train_encoded = load_encoded_comments(args.input_pk2)
 
     # Train Conv1d models and save in the models folder
     print('Training conv1d on', embed, 'embedding')
     conv1d_model = train_conv1d(X_train_encoded[embed], Y_train, embed,
-                                embed_matrices[embed])
+                                embed_matrices[embed], workers=args.workers,
+                                use_multiprocessing=args.use_multiprocessing)
 
     conv1d_model.save(args.output_h5)
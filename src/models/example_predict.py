@@ -15,7 +15,8 @@ import warnings
 warnings.filterwarnings("ignore")
 import pickle
 import pandas as pd
-from src.features.encode_comments import get_encoded_comments
+from src.features.encode_comments import get_encoded_profiles
+from src.models.bucketed_sequence import predict_model
 import numpy as np
 from keras.models import load_model
 
@@ -23,7 +24,6 @@ from keras.models import load_model
 df = pd.DataFrame({'comment': [text]})
 comments = df.iloc[:, 0]
 
-embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
 # Load Embedding Tokenizers
 with open('./models/embed_tokenizers.pickle', 'rb') as handle:
@@ -33,13 +33,9 @@ with open('./models/embed_tokenizers.pickle', 'rb') as handle:
 conv1d = load_model('./models/conv1d_models.h5')
 
 # Make predictions
-encoded_comments = {}
-for embed in embed_names:
-    encoded_comments[embed] = get_encoded_comments(comments,
-                                                   embed_tokenizers[embed],
-                                                   embed)
+encoded_comments = get_encoded_profiles(comments, embed_tokenizers)
 
-Y_pred = conv1d.predict(encoded_comments['glove_wiki'])
+Y_pred = predict_model(conv1d, encoded_comments['glove_wiki'])
 
 # Format predictions and save to csv
 predictions = pd.DataFrame(np.round(Y_pred))
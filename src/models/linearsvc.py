@@ -7,23 +7,39 @@
 # USAGE for train data:
 '''
 python src/models/linearsvc.py \
---input_csv data/interim/train_2018-qualitative-data.csv \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
 --input_npz data/processed/X_train_bow.npz \
 --output_pk models/linearsvc_model.pickle
 '''
 
+# USAGE with hashed features computed from the comments, no npz needed:
+'''
+python src/models/linearsvc.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--subset train \
+--hashing_features 1048576 \
+--output_pk models/linearsvc_model.pickle
+'''
+
 # Import Modules
-import pandas as pd
-import numpy as np
+import sys
+sys.path.insert(1, '.')
 import scipy.sparse
 from skmultilearn.problem_transform import BinaryRelevance
 from sklearn.svm import LinearSVC
 import pickle
 import argparse
+from src.data.qual_dataset import read_labels, read_comments
+from src.features.bow_vectorizer import get_hashing_vectorizer
+from src.features.vectorize_comments import get_vectorized_comments
 
 
 # Default filepath
-filepath_in = './data/interim/train_2018-qualitative-data.csv'
+filepath_in = 'data/interim/desensitized_qualitative-data2018.arrow'
+filepath_index = 'data/interim/split_index_2018.npz'
 filepath_in2 = 'data/processed/X_train_bow.npz'
 filepath_out = 'models/linearsvc_model.pickle'
 
@@ -33,7 +49,18 @@ def get_arguments():
 
     parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
                         action='store', default=filepath_in,
-                        help='the input csv file with comments and labels')
+                        help='the input csv or arrow file with labels')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=filepath_index,
+                        help='the split index file, only the rows of the '
+                        "subset are read from the input file. Pass '' to "
+                        'read every row of the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
 
     parser.add_argument('--input_npz', '-i2', type=str, dest='input_npz',
                         action='store', default=filepath_in2,
@@ -43,6 +70,13 @@ def get_arguments():
                         action='store', default=filepath_out,
                         help='the linear svc model')
 
+    parser.add_argument('--hashing_features', '-n', type=int,
+                        dest='hashing_features', action='store',
+                        default=None,
+                        help='the number of hashing buckets, if given the '
+                        'comments in the input file are hashed instead of '
+                        'reading the npz file')
+
     args = parser.parse_args()
     return args
 
@@ -58,19 +92,48 @@ def train_linearsvc(X_train, Y_train):
     return model_bow
 
 
+def train_linearsvc_sparse(X_train, Y_train):
+    '''Fits one LinearSVC per theme on a sparse matrix without making it
+    dense, for hashed matrices that are far too wide to fit in memory as
+    dense arrays'''
+
+    model_bow = BinaryRelevance(
+        classifier=LinearSVC(C=0.5, tol=0.2),
+        require_dense=[False, True]
+    )
+
+    model_bow.fit(X_train, Y_train)
+
+    return model_bow
+
+
+def train_linearsvc_hashing(comments, Y_train, hashing_features):
+    '''Hashes the comments into hashing_features columns and fits one
+    LinearSVC per theme on the sparse matrix'''
+
+    vectorizer = get_hashing_vectorizer(hashing_features)
+    X_train = get_vectorized_comments(comments, vectorizer)
+
+    return train_linearsvc_sparse(X_train, Y_train)
+
+
 ###############################################################################
 if __name__ == "__main__":
 
     args = get_arguments()
 
     # Get labels
-    df = pd.read_csv(args.input_csv)
-    Y_train = np.array(df.loc[:, "CPD":"OTH"])
-
-    # read in npz file
-    X_train = scipy.sparse.load_npz(args.input_npz)
-
-    linearsvc_model = train_linearsvc(X_train, Y_train)
+    Y_train = read_labels(args.input_csv, args.split_index, args.subset)
+
+    # read in npz file, or hash the comments
+    if args.hashing_features:
+        comments = read_comments(args.input_csv, args.split_index,
+                                 args.subset)
+        linearsvc_model = train_linearsvc_hashing(comments, Y_train,
+                                                  args.hashing_features)
+    else:
+        X_train = scipy.sparse.load_npz(args.input_npz)
+        linearsvc_model = train_linearsvc(X_train, Y_train)
 
     with open(args.output_pk, 'wb') as handle:
         pickle.dump(linearsvc_model, handle, protocol=pickle.HIGHEST_PROTOCOL)
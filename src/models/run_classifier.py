@@ -16,7 +16,8 @@ sys.path.insert(1, '.')
 import pickle
 import pandas as pd
 import argparse
-from src.features.encode_comments import get_encoded_comments
+from src.features.encode_comments import get_encoded_profiles
+from src.models.bucketed_sequence import predict_model
 import numpy as np
 from keras.models import load_model
 
@@ -46,7 +47,6 @@ def get_arguments():
 if __name__ == "__main__":
 
     args = get_arguments()
-    embed_names = ['glove_crawl', 'glove_wiki', 'fasttext_crawl']
 
     df = pd.read_csv(args.input_csv)
     comments = df.iloc[:, 1]
@@ -62,16 +62,13 @@ if __name__ == "__main__":
     biGRU_fasttext_crawl = load_model('./models/biGRU_fasttext_crawl.h5')
 
     # Make predictions
-    encoded_comments = {}
-    for embed in embed_names:
-        encoded_comments[embed] = get_encoded_comments(comments,
-                                                       embed_tokenizers[embed],
-                                                       embed)
-
-    ensemble = (conv1d.predict(encoded_comments['glove_wiki'])
-        + biGRU_glove_crawl.predict(encoded_comments['glove_crawl'])
-        + biGRU_glove_wiki.predict(encoded_comments['glove_wiki'])
-        + biGRU_fasttext_crawl.predict(encoded_comments['fasttext_crawl']))/4
+    encoded_comments = get_encoded_profiles(comments, embed_tokenizers)
+
+    ensemble = (predict_model(conv1d, encoded_comments['glove_wiki'])
+        + predict_model(biGRU_glove_crawl, encoded_comments['glove_crawl'])
+        + predict_model(biGRU_glove_wiki, encoded_comments['glove_wiki'])
+        + predict_model(biGRU_fasttext_crawl,
+                        encoded_comments['fasttext_crawl']))/4
 
     # Format predictions and save to csv
     predictions = pd.DataFrame(np.round(ensemble-0.42))
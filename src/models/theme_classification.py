@@ -9,7 +9,7 @@
 '''
 python src/models/theme_classification.py \
 --input_pk1 models/linearsvc_model.pickle \
---input_pk2 data/processed/X_test_encoded.pickle \
+--input_pk2 data/processed/X_test_encoded \
 --input_npz data/processed/X_test_bow.npz \
 --input1_h5 models/conv1d_models.h5 \
 --input2_h5 models/biGRU_glove_crawl.h5 \
@@ -26,6 +26,8 @@ import pandas as pd
 import scipy.sparse
 import argparse
 from keras.models import load_model
+from src.features.encoded_sequences import load_encoded_comments
+from src.models.bucketed_sequence import predict_model
 
 
 def get_arguments():
@@ -37,7 +39,8 @@ def get_arguments():
 
     parser.add_argument('--input_pk2', '-i2', type=str, dest='input_pk2',
                         action='store',
-                        help='input encoded comments')
+                        help='input encoded comments, a pickle or a '
+                        'directory written by encode_comments.py')
 
     parser.add_argument('--input_npz', '-i3', type=str, dest='input_npz',
                         action='store',
@@ -85,8 +88,7 @@ Y_bow = linearsvc_model.predict(X_text_bow)
 ###############################################################################
 # Predict test data labels with Conv1d and biGRU Models
 # Load Encoded Comments
-with open(args.input_pk2, 'rb') as handle:
-    X_test_encoded = pickle.load(handle)
+X_test_encoded = load_encoded_comments(args.input_pk2)
 
 # Load Neural Net Classification Models
 conv1d = load_model(args.input1_h5)
@@ -94,10 +96,12 @@ biGRU_glove_crawl = load_model(args.input2_h5)
 biGRU_glove_wiki = load_model(args.input3_h5)
 biGRU_fasttext_crawl = load_model(args.input4_h5)
 
-ensemble = (conv1d.predict(X_test_encoded['glove_wiki'])
-            + biGRU_glove_crawl.predict(X_test_encoded['glove_crawl'])
-            + biGRU_glove_wiki.predict(X_test_encoded['glove_wiki'])
-            + biGRU_fasttext_crawl.predict(X_test_encoded['fasttext_crawl']))/4
+# Models trained on bucketed batches predict on the same padding
+ensemble = (predict_model(conv1d, X_test_encoded['glove_wiki'])
+            + predict_model(biGRU_glove_crawl, X_test_encoded['glove_crawl'])
+            + predict_model(biGRU_glove_wiki, X_test_encoded['glove_wiki'])
+            + predict_model(biGRU_fasttext_crawl,
+                            X_test_encoded['fasttext_crawl']))/4
 
 ###############################################################################
 # Save test data predictions
@@ -0,0 +1,314 @@
+# train_ensemble.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# This script trains the members of the ensemble, the biGRU on each embedding
+# and the conv1d on glove wiki, in parallel processes. Each process has its
+# own budget of threads and reads the embedding matrices and encoded
+# comments from memory mapped files instead of its own copy of the pickles.
+# Each model is saved as soon as it has been trained, and models that are
+# newer than their inputs are skipped so an interrupted run can be resumed.
+
+# USAGE:
+'''
+python src/models/train_ensemble.py \
+--input_csv data/interim/desensitized_qualitative-data2018.arrow \
+--split_index data/interim/split_index_2018.npz \
+--input_pk1 models/embed_matrices.pickle \
+--input_pk2 data/processed/X_train_encoded \
+--n_processes 4 \
+--n_threads 8
+'''
+
+# Import Modules
+import sys
+sys.path.insert(1, '.')
+import os
+import time
+import shutil
+import pickle
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+from src.data.qual_dataset import read_labels
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Train the ensemble models '
+                                     'in parallel')
+
+    parser.add_argument('--input_csv', '-i', type=str, dest='input_csv',
+                        action='store',
+                        help='the input csv or arrow file with labels')
+
+    parser.add_argument('--split_index', '-x', type=str, dest='split_index',
+                        action='store', default=None,
+                        help='the split index file, if given only the rows '
+                        'of the subset are read from the input file')
+
+    parser.add_argument('--subset', '-s', type=str, dest='subset',
+                        action='store', default='train',
+                        help="the rows to read with the split index: 'train', "
+                        "'test', a fold number or 'train-<fold>'")
+
+    parser.add_argument('--input_pk1', '-i2', type=str, dest='input_pk1',
+                        action='store', default='models/embed_matrices.pickle',
+                        help='the input embedding_matrix')
+
+    parser.add_argument('--input_pk2', '-i3', type=str, dest='input_pk2',
+                        action='store',
+                        default='data/processed/X_train_encoded',
+                        help='input encoded comments, a pickle or a '
+                        'directory written by encode_comments.py')
+
+    parser.add_argument('--output1_h5', '-o', type=str,
+                        dest='output1_h5', action='store',
+                        default='models/biGRU_glove_crawl.h5',
+                        help='the output biGRU gloveCrawl model')
+
+    parser.add_argument('--output2_h5', '-o2', type=str,
+                        dest='output2_h5', action='store',
+                        default='models/biGRU_glove_wiki.h5',
+                        help='the output biGRU glove Wiki model')
+
+    parser.add_argument('--output3_h5', '-o3', type=str,
+                        dest='output3_h5', action='store',
+                        default='models/biGRU_fasttext_crawl.h5',
+                        help='the output biGRU fasttext Crawl model')
+
+    parser.add_argument('--output4_h5', '-o4', type=str,
+                        dest='output4_h5', action='store',
+                        default='models/conv1d_models.h5',
+                        help='the output conv1d model')
+
+    parser.add_argument('--n_processes', '-n', type=int, dest='n_processes',
+                        action='store', default=4,
+                        help='the number of models trained at once')
+
+    parser.add_argument('--n_threads', '-t', type=int, dest='n_threads',
+                        action='store', default=None,
+                        help='the number of threads of each model, by default '
+                        'the cores are divided between the processes')
+
+    parser.add_argument('--restart', dest='restart', action='store_true',
+                        help='train every model again, by default models '
+                        'newer than their inputs are skipped')
+
+    parser.add_argument('--bucket_batches', '-b', dest='bucket_batches',
+                        action='store_true',
+                        help='train on bucketed batches, needs the encoded '
+                        'comments directory')
+
+    args = parser.parse_args()
+    return args
+
+
+thread_variables = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS',
+                    'TF_NUM_INTEROP_THREADS']
+
+
+@contextlib.contextmanager
+def thread_environment(n_threads):
+    '''Sets the thread variables of the numerical libraries and TensorFlow
+    while the block runs. Processes started in the block read them before
+    they import numpy, the parent's own thread pools are not changed.'''
+    saved = {variable: os.environ.get(variable)
+             for variable in thread_variables}
+    os.environ.update({variable: str(n_threads)
+                       for variable in thread_variables})
+    try:
+        yield
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def limit_threads(n_threads):
+    '''Limits the threads of TensorFlow in this process. Must be called
+    before Keras is imported.'''
+    import tensorflow as tf
+    if hasattr(tf, 'ConfigProto'):
+        from keras import backend as K
+        K.set_session(tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=n_threads,
+            inter_op_parallelism_threads=1)))
+    else:
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def share_arrays(arrays, dirpath, prefix):
+    '''Saves each distinct array of a dictionary to an npy file that the
+    processes memory map, and returns the file path for each key'''
+    paths = {}
+    saved = {}
+    for key, array in arrays.items():
+        if id(array) not in saved:
+            saved[id(array)] = os.path.join(dirpath, '%s_%s.npy'
+                                            % (prefix, key))
+            np.save(saved[id(array)], array)
+        paths[key] = saved[id(array)]
+
+    return paths
+
+
+def newest_mtime(paths):
+    '''Returns the latest modification time of the files, and of the files
+    in the directories, 0 if there are none'''
+    mtimes = [0]
+    for path in paths:
+        if path is None or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            mtimes.extend(os.path.getmtime(os.path.join(path, name))
+                          for name in os.listdir(path))
+        mtimes.append(os.path.getmtime(path))
+
+    return max(mtimes)
+
+
+def is_up_to_date(output_h5, model, inputs):
+    '''Returns True if the model file exists and is newer than the inputs and
+    the script that defines the model'''
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          model + '.py')
+    return os.path.exists(output_h5) and \
+        os.path.getmtime(output_h5) >= newest_mtime(list(inputs) + [source])
+
+
+def _train_member(job):
+    '''Trains one model in a worker process and saves it'''
+    (model, embed, output_h5, filepath_matrix, filepath_X, filepath_Y,
+     n_threads, bucket_batches) = job
+    limit_threads(n_threads)
+
+    from src.features.encoded_sequences import read_encoded
+    from src.models.biGRU import train_biGRU
+    from src.models.conv1d import train_conv1d
+
+    embed_matrix = np.load(filepath_matrix, mmap_mode='r')
+    Y_train = np.load(filepath_Y, mmap_mode='r')
+    if os.path.isdir(filepath_X):
+        X_train = read_encoded(filepath_X)[embed]
+        if not bucket_batches:
+            X_train = X_train.pad(buckets=[700])
+    else:
+        X_train = np.load(filepath_X, mmap_mode='r')
+
+    start = time.time()
+    train = {'biGRU': train_biGRU, 'conv1d': train_conv1d}[model]
+    trained = train(X_train, Y_train, embed, embed_matrix)
+
+    # Save under a temporary name first so a resumed run never sees a model
+    # that was only partly written
+    partial = os.path.join(os.path.dirname(output_h5) or '.',
+                           '.partial-' + os.path.basename(output_h5))
+    trained.save(partial)
+    os.replace(partial, output_h5)
+
+    return model, embed, output_h5, time.time() - start
+
+
+def train_ensemble(members, embed_matrices, X_train_encoded, Y_train,
+                   n_processes=4, n_threads=None, restart=False,
+                   bucket_batches=False, inputs=()):
+    '''Trains the members of the ensemble in parallel processes
+
+    Parameters
+    ----------
+    members : list of (model, embedding, output h5 path), model is 'biGRU'
+        or 'conv1d'
+    embed_matrices : dict with the embedding matrix of each embedding
+    X_train_encoded : dict with the padded encoded comments of each
+        embedding, or the path of the encoded comments directory
+    Y_train : numpy array of labels
+    n_processes : int, number of models trained at once
+    n_threads : int, threads of each model, by default the cores are
+        divided between the processes
+    restart : bool, train the members whose model is up to date again
+    bucket_batches : bool, train on bucketed batches, needs the directory
+    inputs : list of the files and directories the data was read from, a
+        member is skipped if its model is newer than all of them
+    '''
+    if not restart:
+        up_to_date = [is_up_to_date(output_h5, model, inputs)
+                      for model, _, output_h5 in members]
+        for (model, embed, output_h5), skip in zip(members, up_to_date):
+            if skip:
+                print('Skipping', model, 'on', embed, 'embedding,',
+                      output_h5, 'is up to date')
+        members = [member for member, skip in zip(members, up_to_date)
+                   if not skip]
+    if not members:
+        return
+
+    n_processes = min(n_processes, len(members))
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // n_processes)
+
+    dirpath = tempfile.mkdtemp(prefix='ensemble-',
+                               dir=os.path.dirname(members[0][2]) or '.')
+    try:
+        embeds = {embed for _, embed, _ in members}
+        paths_matrix = share_arrays({embed: embed_matrices[embed]
+                                     for embed in embeds}, dirpath, 'matrix')
+        if isinstance(X_train_encoded, str):
+            paths_X = {embed: X_train_encoded for embed in embeds}
+        else:
+            paths_X = share_arrays({embed: X_train_encoded[embed]
+                                    for embed in embeds}, dirpath, 'X')
+        filepath_Y = share_arrays({'train': Y_train}, dirpath, 'Y')['train']
+
+        jobs = [(model, embed, output_h5, paths_matrix[embed], paths_X[embed],
+                 filepath_Y, n_threads, bucket_batches)
+                for model, embed, output_h5 in members]
+
+        # A fresh process for each model so the thread settings apply before
+        # numpy and TensorFlow start and its memory is released when it is
+        # done
+        context = multiprocessing.get_context('spawn')
+        with thread_environment(n_threads), \
+                context.Pool(n_processes, maxtasksperchild=1) as pool:
+            for model, embed, output_h5, elapsed in pool.imap_unordered(
+                    _train_member, jobs):
+                print('Saved', model, 'on', embed, 'embedding to', output_h5,
+                      'after %.0f s' % elapsed)
+    finally:
+        shutil.rmtree(dirpath, ignore_errors=True)
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    args = get_arguments()
+
+    members = [('biGRU', 'glove_crawl', args.output1_h5),
+               ('biGRU', 'glove_wiki', args.output2_h5),
+               ('biGRU', 'fasttext_crawl', args.output3_h5),
+               ('conv1d', 'glove_wiki', args.output4_h5)]
+
+    # Get labels
+    Y_train = read_labels(args.input_csv, args.split_index, args.subset)
+
+    # Load embedding matrices
+    with open(args.input_pk1, 'rb') as handle:
+        embed_matrices = pickle.load(handle)
+
+    # Encoded comments directories are memory mapped by each process
+    if os.path.isdir(args.input_pk2):
+        X_train_encoded = args.input_pk2
+    else:
+        with open(args.input_pk2, 'rb') as handle:
+            X_train_encoded = pickle.load(handle)
+
+    inputs = [args.input_csv, args.split_index, args.input_pk1,
+              args.input_pk2]
+    train_ensemble(members, embed_matrices, X_train_encoded, Y_train,
+                   args.n_processes, args.n_threads, args.restart,
+                   args.bucket_batches, inputs)
@@ -0,0 +1,61 @@
+# test_preprocessing.py
+# Author: Fan Nie, Ayla Pearson, Aaron Quinton
+# Date: 2019-06-28
+
+# Checks that the sharded multi-process preprocessing gives the same results
+# as the serial run on the comments of the sample spreadsheet.
+
+# USAGE:
+'''
+python -m pytest tests
+'''
+
+# Import Modules
+import os
+import sys
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(1, root)
+import pandas as pd
+import pytest
+from src.data.preprocessing_cache import PreprocessingCache
+from src.data.preprocessing_text import preprocess_profiles
+
+filepath_sample = os.path.join(root, 'data', 'raw',
+                               '2018_wes_qual_sample.xlsx')
+profiles = ['glove_crawl', 'glove_wiki', 'fasttext_crawl', 'bow']
+
+
+@pytest.fixture(scope='module')
+def comments():
+    df = pd.read_excel(filepath_sample)
+    return df[df.iloc[:, 1].notnull()].iloc[:, 1].tolist()
+
+
+@pytest.fixture(scope='module')
+def chunksize(comments):
+    # Small enough that the comments are split across all the processes
+    return max(1, len(comments) // 16)
+
+
+@pytest.mark.parametrize('split', [True, False])
+def test_sharded_matches_serial(comments, chunksize, split):
+    serial = preprocess_profiles(comments, profiles, split=split,
+                                 chunksize=chunksize, n_workers=1)
+    sharded = preprocess_profiles(comments, profiles, split=split,
+                                  chunksize=chunksize, n_workers=4)
+
+    assert sharded == serial
+
+
+def test_cached_matches_serial(comments, chunksize, tmp_path):
+    serial = preprocess_profiles(comments, profiles, chunksize=chunksize,
+                                 n_workers=1)
+
+    # The first run fills the cache from the processes, the second reads
+    # every comment back from it
+    with PreprocessingCache(str(tmp_path / 'cache.sqlite3')) as cache:
+        for _ in range(2):
+            cached = preprocess_profiles(comments, profiles,
+                                         chunksize=chunksize, n_workers=4,
+                                         cache=cache)
+            assert cached == serial